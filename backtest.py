@@ -0,0 +1,320 @@
+import os
+import time
+import argparse
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from main import profit_pct_estimate, BASE_EXCHANGES
+
+
+# grid swept when none is given, around the values used in execute. It starts at the screening floor of execute,
+# profit_pct_trig - SCREEN_MARGIN_PCT, below it the exchanges compared against have no recorded orderbooks
+DEFAULT_PROFIT_PCT_TRIGS = np.arange(3, 10.5, 0.5)
+DEFAULT_ABS_PROFIT_TRIGS = [1000, 2500, 5000, 10000, 20000, 50000]
+DEFAULT_LQTT_TRIGS = [1000, 5000, 10000, 25000, 50000]
+
+# (run, ticker) groups combined per batch, bounds the memory of their packed masks
+GROUP_BATCH = 1_000_000
+
+
+def load_dataset (path, columns, start=None, end=None) :
+    '''
+    Reads one dataset written by SnapshotRecorder, optionally between start and end (anything pd.Timestamp accepts, UTC).
+    '''
+
+    filters = []
+
+    # whole days outside the range are skipped through the date partitions
+    if start is not None :
+        filters.append(('date', '>=', pd.Timestamp(start).strftime('%Y-%m-%d')))
+    if end is not None :
+        filters.append(('date', '<=', pd.Timestamp(end).strftime('%Y-%m-%d')))
+
+    df = pd.read_parquet(path, columns=columns, filters=filters or None)
+
+    if start is not None :
+        df = df[df['run_time'] >= pd.Timestamp(start)]
+    if end is not None :
+        df = df[df['run_time'] <= pd.Timestamp(end)]
+
+    return df.reset_index(drop=True)
+
+
+def load_snapshots (directory, start=None, end=None) :
+    '''
+    The venues dataset of SNAPSHOT_DIR, one row per exchange and ticker of every run.
+    '''
+
+    columns = ['run_time', 'exchange', 'base_ticker', 'price_usd', 'ask_price_usd', 'lqtt_usd', 'book', 'screen_pct']
+
+    return load_dataset(os.path.join(directory, 'venues'), columns, start, end)
+
+
+def load_walked (directory, start=None, end=None) :
+    '''
+    The pairs dataset of SNAPSHOT_DIR, abs_profit and size_usd as walked by check_venue_table. None when nothing was recorded.
+    '''
+
+    # the directory can be a URI like s3://bucket/prefix, pyarrow tells whether the dataset is there
+    try :
+        return load_dataset(os.path.join(directory, 'pairs'), ['run_time', 'base_ticker', 'base', 'against', 'abs_profit', 'size_usd'], start, end)
+    except FileNotFoundError :
+        return None
+
+
+def pair_table (snapshots, walked=None) :
+    '''
+    Every (run, ticker, base exchange, exchange compared against) pair of the snapshots with profit_pct and abs_profit,
+    same formula as check_venue_table : the premium of the base bid over the against price, minus the ETH exit discount of the pair in that run.
+
+    abs_profit is the walked one recorded in the pairs dataset (see load_walked). Pairs it has no walk for fall back to profit_pct on the whole
+    2% depth liquidity, as check_venue_table does without the levels.
+    '''
+
+    snapshots = snapshots.astype({'exchange' : str, 'base_ticker' : str})
+
+    is_base = snapshots['exchange'].isin(BASE_EXCHANGES)
+
+    df_base = snapshots[is_base].drop(columns='book').rename(columns={'exchange' : 'base', 'price_usd' : 'price_usd_base', 'ask_price_usd' : 'ask_price_usd_base', 'lqtt_usd' : 'base_lqtt_usd'})
+    df_against = snapshots[~is_base].drop(columns=['ask_price_usd', 'screen_pct']).rename(columns={'exchange' : 'against', 'price_usd' : 'price_usd_against', 'lqtt_usd' : 'against_lqtt'})
+
+    pairs = pd.merge(df_base, df_against, on=['run_time', 'base_ticker'], how='inner')
+
+    # ask price pct difference of ETH, per run and pair
+    eth = pairs[pairs['base_ticker'] == 'ETH']
+    eth = eth.assign(base_eth_ask_price_pct=abs(eth['ask_price_usd_base'] - eth['price_usd_against']) / eth['price_usd_against'])
+    pairs = pd.merge(pairs, eth[['run_time', 'base', 'against', 'base_eth_ask_price_pct']], on=['run_time', 'base', 'against'], how='left')
+
+    usd_diff = pairs['price_usd_base'] - pairs['price_usd_against']
+    pct_diff = abs(usd_diff / pairs['price_usd_against'])
+
+    # only the case when base price > against price
+    pairs['profit_pct'] = profit_pct_estimate(pct_diff, pairs['base_eth_ask_price_pct']).where(usd_diff > 0)
+    pairs['abs_profit'] = pairs['profit_pct'] / 100 * pairs['base_lqtt_usd']
+
+    if walked is not None and len(walked) :
+        walked = walked.astype({'base_ticker' : str, 'base' : str, 'against' : str})
+        pairs = pd.merge(pairs, walked.rename(columns={'abs_profit' : 'walked_abs_profit'}), on=['run_time', 'base_ticker', 'base', 'against'], how='left')
+        pairs['abs_profit'] = pairs['walked_abs_profit'].where(pairs['walked_abs_profit'].notna(), pairs['abs_profit'])
+
+    # book is False when the against price is a bulk ticker price, the ticker was screened out and has no liquidity to trigger on
+    return pairs[['run_time', 'base_ticker', 'base', 'against', 'profit_pct', 'abs_profit', 'base_lqtt_usd', 'against_lqtt', 'book', 'screen_pct']]
+
+
+def threshold_grid (profit_pct_trigs, abs_profit_trigs, lqtt_trigs) :
+    '''
+    Every combination of the three thresholds, as three flat arrays.
+    '''
+
+    grid = np.array(list(itertools.product(profit_pct_trigs, abs_profit_trigs, lqtt_trigs)), dtype=float)
+
+    return grid[:, 0], grid[:, 1], grid[:, 2]
+
+
+def pattern_masks (profit_pct_trig, abs_profit_trig, lqtt_trig) :
+    '''
+    A row passes the thresholds of an axis that are below its value, so which grid points it triggers only depends on how many distinct thresholds
+    of each axis are below it. Returns the grid mask of every such pattern, packed 8 grid points to a byte, and the rank function of each axis.
+
+    The pattern of ranks (p, a, l) is row (p * (n_a + 1) + a) * (n_l + 1) + l of the masks.
+    '''
+
+    axes = [np.unique(trig) for trig in (profit_pct_trig, abs_profit_trig, lqtt_trig)]
+
+    # position of every grid point's threshold on its axis, a pattern covers it when its rank on every axis is above that
+    positions = [np.searchsorted(axis, trig) for axis, trig in zip(axes, (profit_pct_trig, abs_profit_trig, lqtt_trig))]
+    ranks = [rank.reshape(-1) for rank in np.meshgrid(*[np.arange(len(axis) + 1) for axis in axes], indexing='ij')]
+
+    covered = np.ones((len(ranks[0]), len(profit_pct_trig)), dtype=bool)
+    for rank, position in zip(ranks, positions) :
+        covered &= position[None, :] < rank[:, None]
+
+    def pattern (profit_pct, abs_profit, lqtt) :
+        # count of thresholds strictly below each value
+        p, a, l = [np.searchsorted(axis, values, side='left') for axis, values in zip(axes, (profit_pct, abs_profit, lqtt))]
+        return (p * (len(axes[1]) + 1) + a) * (len(axes[2]) + 1) + l
+
+    return np.packbits(covered, axis=1), pattern
+
+
+def mask_sums (masks, n_grid, weights=None) :
+    '''
+    Per grid point, the sum of weights (the count without them) of the packed masks that have it. Only the distinct masks are unpacked.
+    '''
+
+    if not len(masks) :
+        return np.zeros(n_grid)
+
+    keys = np.ascontiguousarray(masks).view(np.dtype((np.void, masks.shape[1]))).reshape(-1)
+    unique, inverse = np.unique(keys, return_inverse=True)
+
+    sums = np.bincount(inverse.reshape(-1), weights=weights, minlength=len(unique))
+    bits = np.unpackbits(unique.view(np.uint8).reshape(len(unique), -1), axis=1, count=n_grid)
+
+    return sums @ bits
+
+
+def combine_masks (target, ids, masks) :
+    '''
+    ORs every mask into target at its id, the ids sorted so each id is combined in one reduceat.
+    '''
+
+    id_starts = np.flatnonzero(np.r_[True, np.diff(ids) != 0])
+    target[ids[id_starts]] |= np.bitwise_or.reduceat(masks, id_starts, axis=0)
+
+
+def sweep (pairs, profit_pct_trigs=DEFAULT_PROFIT_PCT_TRIGS, abs_profit_trigs=DEFAULT_ABS_PROFIT_TRIGS, lqtt_trigs=DEFAULT_LQTT_TRIGS) :
+    '''
+    Evaluates the trigger of check_price_diff for every grid point at once. Every row is reduced to its pattern mask (see pattern_masks),
+    the masks are combined per (run, ticker) group, in batches of GROUP_BATCH groups, and only then expanded to the grid.
+
+    Per grid point :
+    alerts - (run, ticker) with a triggered pair, what execute sends without the alert state (one message per ticker per run)
+    episodes - alerts whose ticker didn't trigger in the previous run, roughly what is sent with the alert state
+    tickers - distinct tickers alerted
+    runs - runs with at least one alert
+    abs_profit - sum over the alerts of the best triggered abs_profit
+    unsized - (run, ticker) with a pair above profit_pct_trig on an exchange compared against that was screened out, without an orderbook to size it
+    '''
+
+    profit_pct_trig, abs_profit_trig, lqtt_trig = threshold_grid(profit_pct_trigs, abs_profit_trigs, lqtt_trigs)
+    n_grid = len(profit_pct_trig)
+
+    # run index across all runs of the snapshots, so consecutive runs can be told apart from gaps
+    run_index = pairs['run_time'].rank(method='dense').to_numpy(dtype=np.int64) - 1
+    n_runs = run_index.max() + 1 if len(run_index) else 0
+
+    # best premium of every (run, ticker) that only has bulk prices, compared with the profit thresholds directly
+    unsized_pairs = pairs[~pairs['book'].to_numpy(dtype=bool) & (pairs['profit_pct'] > 0).to_numpy()]
+    unsized_best = np.sort(unsized_pairs.groupby(['run_time', 'base_ticker'])['profit_pct'].max().to_numpy())
+    unsized = len(unsized_best) - np.searchsorted(unsized_best, profit_pct_trig, side='right')
+
+    # rows no grid point can trigger on are dropped before the masks are looked up
+    keep = (
+        (pairs['profit_pct'] > profit_pct_trig.min())
+        & (pairs['abs_profit'] > abs_profit_trig.min())
+        & (pairs['base_lqtt_usd'] > lqtt_trig.min())
+        & (pairs['against_lqtt'] > lqtt_trig.min())
+    ).to_numpy()
+
+    pairs = pairs[keep]
+    run_index = run_index[keep]
+
+    # grouped by (ticker, run), the best abs_profit first within a group. Tickers as integer codes, compared much faster than strings
+    abs_profit = pairs['abs_profit'].to_numpy(dtype=float)
+    ticker_codes, ticker_names = pd.factorize(pairs['base_ticker'])
+    order = np.lexsort((-abs_profit, run_index, ticker_codes))
+    tickers = ticker_codes[order]
+    run_index = run_index[order]
+    abs_profit = abs_profit[order]
+    min_lqtt = np.minimum(pairs['base_lqtt_usd'].to_numpy(dtype=float), pairs['against_lqtt'].to_numpy(dtype=float))[order]
+
+    masks, pattern = pattern_masks(profit_pct_trig, abs_profit_trig, lqtt_trig)
+    row_pattern = pattern(pairs['profit_pct'].to_numpy(dtype=float)[order], abs_profit, min_lqtt)
+
+    # first row and size of every (ticker, run) group
+    new_group = np.ones(len(tickers), dtype=bool)
+    new_group[1:] = (tickers[1:] != tickers[:-1]) | (run_index[1:] != run_index[:-1])
+    starts = np.flatnonzero(new_group)
+    sizes = np.diff(np.append(starts, len(tickers)))
+
+    group_tickers = tickers[starts]
+    group_runs = run_index[starts]
+
+    # an episode starts when the same ticker didn't alert in the run right before
+    continues = np.zeros(len(starts), dtype=bool)
+    continues[1:] = (group_tickers[1:] == group_tickers[:-1]) & (group_runs[1:] == group_runs[:-1] + 1)
+
+    alerts = np.zeros(n_grid)
+    episodes = np.zeros(n_grid)
+    total_profit = np.zeros(n_grid)
+    run_masks = np.zeros((n_runs, masks.shape[1]), dtype=np.uint8)
+    ticker_masks = np.zeros((len(ticker_names), masks.shape[1]), dtype=np.uint8)
+
+    previous = np.zeros(masks.shape[1], dtype=np.uint8)
+
+    for batch_start in range(0, len(starts), GROUP_BATCH) :
+        batch = slice(batch_start, batch_start + GROUP_BATCH)
+        batch_starts = starts[batch]
+        batch_sizes = sizes[batch]
+
+        # rows are added to their group's mask from the best abs_profit down, what a row adds is where it is the best triggered abs_profit
+        covered = np.zeros((len(batch_starts), masks.shape[1]), dtype=np.uint8)
+
+        for position in range(batch_sizes.max()) :
+            groups = np.flatnonzero(batch_sizes > position)
+            rows = batch_starts[groups] + position
+
+            row_masks = masks[row_pattern[rows]]
+            total_profit += mask_sums(row_masks & ~covered[groups], n_grid, abs_profit[rows])
+            covered[groups] |= row_masks
+
+        # the mask of the group before, the first one comes from the previous batch
+        before = np.vstack([previous[None, :], covered[:-1]])
+        before[~continues[batch]] = 0
+        previous = covered[-1]
+
+        alerts += mask_sums(covered, n_grid)
+        episodes += mask_sums(covered & ~before, n_grid)
+
+        # the groups are already sorted by ticker, by run they have to be sorted first
+        by_run = np.argsort(group_runs[batch], kind='stable')
+        combine_masks(run_masks, group_runs[batch][by_run], covered[by_run])
+        combine_masks(ticker_masks, group_tickers[batch], covered)
+
+    return pd.DataFrame({
+        'profit_pct_trig' : profit_pct_trig,
+        'abs_profit_trig' : abs_profit_trig,
+        'lqtt_trig' : lqtt_trig,
+        'alerts' : alerts.astype(np.int64),
+        'episodes' : episodes.astype(np.int64),
+        'tickers' : mask_sums(ticker_masks, n_grid).astype(np.int64),
+        'runs' : mask_sums(run_masks, n_grid).astype(np.int64),
+        'abs_profit' : total_profit,
+        'unsized' : unsized
+    })
+
+
+def backtest (directory, start=None, end=None, **grid) :
+    start_time = time.perf_counter()
+    snapshots = load_snapshots(directory, start, end)
+    walked = load_walked(directory, start, end)
+    load_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    pairs = pair_table(snapshots, walked)
+    pair_time = time.perf_counter() - start_time
+
+    # below the screening floor only the tickers that passed screening for a higher threshold have orderbooks, alerts there are undercounted
+    screen_floor = pairs['screen_pct'].max()
+    if min(grid.get('profit_pct_trigs', DEFAULT_PROFIT_PCT_TRIGS)) < screen_floor :
+        print('profit_pct thresholds below {:.2f} % are undercounted, the runs were screened from there. See the unsized column'.format(screen_floor))
+
+    start_time = time.perf_counter()
+    results = sweep(pairs, **grid)
+    sweep_time = time.perf_counter() - start_time
+
+    print('{} runs, {} pairs, {} grid points - load {:.2f} s, pairs {:.2f} s, sweep {:.2f} s'.format(
+        snapshots['run_time'].nunique(), len(pairs), len(results), load_time, pair_time, sweep_time
+    ))
+
+    return results
+
+
+if __name__ == '__main__' :
+    parser = argparse.ArgumentParser(description='sweeps the alert thresholds of execute over the snapshots recorded by SnapshotRecorder')
+    parser.add_argument('directory', help='SNAPSHOT_DIR the runs were recorded to')
+    parser.add_argument('--start')
+    parser.add_argument('--end')
+    parser.add_argument('--profit-pct', type=float, nargs='+', default=DEFAULT_PROFIT_PCT_TRIGS)
+    parser.add_argument('--abs-profit', type=float, nargs='+', default=DEFAULT_ABS_PROFIT_TRIGS)
+    parser.add_argument('--lqtt', type=float, nargs='+', default=DEFAULT_LQTT_TRIGS)
+    parser.add_argument('--top', type=int, default=20, help='grid points printed, fewest episodes with any alert first')
+    args = parser.parse_args()
+
+    results = backtest(args.directory, args.start, args.end, profit_pct_trigs=args.profit_pct, abs_profit_trigs=args.abs_profit, lqtt_trigs=args.lqtt)
+
+    with pd.option_context('display.width', 200, 'display.max_columns', None) :
+        print(results[results['alerts'] > 0].sort_values(['episodes', 'abs_profit'], ascending=[True, False]).head(args.top).to_string(index=False))
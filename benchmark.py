@@ -0,0 +1,727 @@
+import os
+
+# the harness never touches mongo, alert and universe state stay in the process
+os.environ.setdefault('ALERT_STORE', 'memory')
+os.environ.setdefault('UNIVERSE_STORE', 'memory')
+
+import time
+import json
+import random
+import argparse
+import datetime
+import threading
+import tracemalloc
+import contextlib
+import statistics
+import urllib.parse
+import asyncio
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pandas as pd
+from aiohttp import web
+
+import main
+from main import depth_columns, depth_rows, base_frame
+
+
+def synthetic_books (n_symbols, n_levels=15) :
+    '''
+    Returns n_symbols (ticker, bids, asks) books with n_levels levels per side, prices as strings like the exchanges send them.
+    '''
+
+    books = []
+
+    for i in range(n_symbols) :
+        mid = random.uniform(0.01, 1000)
+        bids = [(str(mid * (1 - 0.001 * (level + 1))), str(random.uniform(1, 100))) for level in range(n_levels)]
+        asks = [(str(mid * (1 + 0.001 * (level + 1))), str(random.uniform(1, 100))) for level in range(n_levels)]
+        books.append(('KRW-T' + str(i), bids, asks))
+
+    return books
+
+
+def build_by_append (rows) :
+    '''
+    How the frames used to be built, one df.loc[len(df)] = output per ticker.
+    '''
+
+    columns = ['base_ticker', 'bid_price_krw', 'ask_price_krw', 'base_lqtt']
+    df = pd.DataFrame(columns=columns)
+
+    for output in rows :
+        df.loc[len(df)] = output
+
+    return df
+
+
+def benchmark_frame_build (sizes=(100, 1000, 10000), repeat=3) :
+    '''
+    Frame build time of a base exchange at different symbol counts, row appends vs columns built once.
+    The kernel is run once up front, so only the frame build is timed.
+    '''
+
+    print('{:>8} {:>14} {:>14} {:>9}'.format('symbols', 'append (s)', 'columnar (s)', 'speedup'))
+
+    for size in sizes :
+        books = synthetic_books(size)
+        rows = depth_rows(books, 'bids')
+        tickers, bid_price_krw, ask_price_krw, base_lqtt = depth_columns(books, 'bids')
+
+        append_time = float('inf')
+        columnar_time = float('inf')
+
+        for _ in range(repeat) :
+            start_time = time.perf_counter()
+            build_by_append(rows)
+            append_time = min(append_time, time.perf_counter() - start_time)
+
+            start_time = time.perf_counter()
+            base_frame(tickers, bid_price_krw, ask_price_krw, base_lqtt, 1300)
+            columnar_time = min(columnar_time, time.perf_counter() - start_time)
+
+        print('{:>8} {:>14.5f} {:>14.5f} {:>8.0f}x'.format(size, append_time, columnar_time, append_time / columnar_time))
+
+
+####################################### offline end to end benchmark #######################################
+
+# recorded market snapshots are kept here, see record_snapshot
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_fixtures')
+
+AGAINST_VENUES = ['binance', 'bybit', 'bitget', 'mexc']
+
+
+def assign_markets (assets, premium_share=0.03, premium=0.08, seed=0) :
+    '''
+    Gives every asset of a snapshot its 2% depth in USD, and a premium on the base exchanges to premium_share of them so execute has alerts to send.
+    '''
+
+    rng = random.Random(seed)
+
+    for asset, market in assets.items() :
+        market['depth_usd'] = rng.uniform(1e5, 3e6)
+        market['premium'] = premium if asset != 'ETH' and rng.random() < premium_share else 0
+
+    return assets
+
+
+def synthetic_snapshot (n_assets=250, krw_usd=1350.0, seed=0) :
+    '''
+    Market snapshot shaped like the live one : about n_assets assets listed on upbit or bithumb, most of them also on the exchanges compared against,
+    and twice as many assets only listed on the exchanges compared against.
+    '''
+
+    rng = random.Random(seed)
+    assets = {}
+
+    for i in range(n_assets * 3) :
+        asset = ['BTC', 'ETH'][i] if i < 2 else 'A' + str(i)
+        venues = []
+
+        # the first third are korean listings
+        if i < n_assets :
+            if i < 2 or rng.random() < 0.75 :
+                venues.append('upbit')
+            if i < 2 or rng.random() < 0.75 or 'upbit' not in venues :
+                venues.append('bithumb')
+
+        venues += [venue for venue in AGAINST_VENUES if i < 2 or rng.random() < 0.8]
+
+        assets[asset] = {'usd' : 10 ** rng.uniform(-3, 4), 'venues' : venues}
+
+    return {'krw_usd' : krw_usd, 'assets' : assign_markets(assets, seed=seed)}
+
+
+def scale_snapshot (snapshot, factor) :
+    '''
+    Multiplies the symbol universe by factor, every asset gets factor - 1 copies with the same listings under a new name.
+    '''
+
+    assets = {}
+
+    for copy in range(factor) :
+        for asset, market in snapshot['assets'].items() :
+            assets[asset if copy == 0 else asset + 'X' + str(copy)] = dict(market)
+
+    return {'krw_usd' : snapshot['krw_usd'], 'assets' : assets}
+
+
+def record_snapshot (name='live', krw_usd=1350.0) :
+    '''
+    Records the listings and prices of the live exchanges into FIXTURE_DIR/<name>.json, for replay by StubExchange.
+    Needs network access, the USD price of an asset is the median over the exchanges compared against.
+    '''
+
+    listings = {exchange : main.UNIVERSE_SOURCES[exchange]() for exchange in ['upbit', 'bithumb'] + AGAINST_VENUES}
+
+    prices = {}
+    venues = {}
+
+    for exchange, ticker_list in listings.items() :
+        for symbol in ticker_list :
+            asset = main.base_asset(exchange, symbol)
+            if asset is None :
+                continue
+
+            venues.setdefault(asset, []).append(exchange)
+            if isinstance(ticker_list, dict) and ticker_list[symbol] > 0 :
+                prices.setdefault(asset, []).append(ticker_list[symbol])
+
+    # base only assets have no USD price to replay
+    assets = {asset : {'usd' : statistics.median(prices[asset]), 'venues' : venues[asset]} for asset in prices}
+    snapshot = {'krw_usd' : krw_usd, 'assets' : assign_markets(assets)}
+
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+
+    with open(os.path.join(FIXTURE_DIR, name + '.json'), 'w') as f :
+        json.dump(snapshot, f)
+
+    return snapshot
+
+
+def load_snapshot (name) :
+    with open(os.path.join(FIXTURE_DIR, name + '.json')) as f :
+        return json.load(f)
+
+
+def book_levels (price, depth, n_levels, step=0.0005) :
+    '''
+    n_levels bids and asks around price, sized so the levels add up to about depth in the quote currency.
+    '''
+
+    size = depth / n_levels / price
+
+    bids = [(price * (1 - step * (level + 1)), size * random.uniform(0.5, 1.5)) for level in range(n_levels)]
+    asks = [(price * (1 + step * (level + 1)), size * random.uniform(0.5, 1.5)) for level in range(n_levels)]
+
+    return bids, asks
+
+
+class StubExchange :
+    '''
+    Local HTTP server answering the REST endpoints main.py uses (the exchanges and telegram) in each exchange's response format, rendered from a market snapshot.
+    main.API_BASE_URL is pointed at it, requests arrive as /<original host>/<path>.
+
+    Every response is delayed by latency plus a uniform jitter, and rate_429 of the exchange requests are answered with a 429 and Retry-After : retry_after.
+    '''
+
+    def __init__ (self, snapshot, latency=0.02, jitter=0.01, rate_429=0.0, retry_after=0) :
+        self.snapshot = snapshot
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.responses_429 = 0
+        self.bytes_sent = 0
+
+        self.server = None
+
+    def listed (self, venue) :
+        return [asset for asset, market in self.snapshot['assets'].items() if venue in market['venues']]
+
+    def price (self, asset, venue) :
+        market = self.snapshot['assets'][asset]
+
+        if venue in main.BASE_EXCHANGES :
+            return market['usd'] * self.snapshot['krw_usd'] * (1 + market['premium'])
+
+        return market['usd']
+
+    def depth (self, asset, venue) :
+        market = self.snapshot['assets'][asset]
+
+        if venue in main.BASE_EXCHANGES :
+            return market['depth_usd'] * self.snapshot['krw_usd']
+
+        return market['depth_usd']
+
+    def book (self, asset, venue, n_levels) :
+        return book_levels(self.price(asset, venue), self.depth(asset, venue), n_levels)
+
+    def asset_of (self, venue, symbol) :
+        asset = main.base_asset(venue, symbol) if symbol else None
+        if asset in self.snapshot['assets'] and venue in self.snapshot['assets'][asset]['venues'] :
+            return asset
+        return None
+
+    def respond (self, host, path, query) :
+        '''
+        Returns (status, payload) for one request.
+        '''
+
+        if host == 'api.telegram.org' :
+            return 200, {'ok' : True}
+
+        if host == 'api.upbit.com' :
+            if path == '/v1/market/all' :
+                # BTC markets are listed too, they have to be filtered out
+                return 200, [{'market' : 'KRW-' + asset, 'english_name' : asset} for asset in self.listed('upbit')] + [{'market' : 'BTC-ETH', 'english_name' : 'ETH'}]
+
+            if path == '/v1/orderbook' :
+                books = []
+                for market in query.get('markets', '').split(',') :
+                    asset = self.asset_of('upbit', market)
+                    if asset :
+                        bids, asks = self.book(asset, 'upbit', 15)
+                        units = [{'ask_price' : ask[0], 'bid_price' : bid[0], 'ask_size' : ask[1], 'bid_size' : bid[1]} for bid, ask in zip(bids, asks)]
+                        books.append({'market' : market, 'timestamp' : int(time.time() * 1000), 'orderbook_units' : units})
+                return 200, books
+
+        if host == 'api.bithumb.com' :
+            if path == '/public/ticker/ALL_KRW' :
+                data = {asset : {'closing_price' : str(self.price(asset, 'bithumb'))} for asset in self.listed('bithumb')}
+                data['date'] = str(int(time.time() * 1000))
+                return 200, {'status' : '0000', 'data' : data}
+
+            if path.startswith('/public/orderbook/') :
+                n_levels = int(query.get('count', 30))
+
+                def bithumb_book (asset) :
+                    bids, asks = self.book(asset, 'bithumb', n_levels)
+                    return {
+                        'order_currency' : asset,
+                        'bids' : [{'price' : str(price), 'quantity' : str(size)} for price, size in bids],
+                        'asks' : [{'price' : str(price), 'quantity' : str(size)} for price, size in asks]
+                    }
+
+                ticker = path.rsplit('/', 1)[1]
+
+                if ticker == 'ALL_KRW' :
+                    data = {asset : bithumb_book(asset) for asset in self.listed('bithumb')}
+                    data['timestamp'] = str(int(time.time() * 1000))
+                    data['payment_currency'] = 'KRW'
+                    return 200, {'status' : '0000', 'data' : data}
+
+                asset = self.asset_of('bithumb', ticker.replace('_KRW', ''))
+                if asset :
+                    return 200, {'status' : '0000', 'data' : bithumb_book(asset)}
+                return 200, {'status' : '5500', 'message' : 'Invalid Parameter'}
+
+        if host in ('api.binance.com', 'api.mexc.com') :
+            venue = main.EXCHANGE_HOSTS[host]
+
+            if path == '/api/v3/ticker/price' :
+                return 200, [{'symbol' : asset + 'USDT', 'price' : str(self.price(asset, venue))} for asset in self.listed(venue)]
+
+            if path == '/api/v3/depth' :
+                asset = self.asset_of(venue, query.get('symbol'))
+                if asset is None :
+                    return 400, {'code' : -1121, 'msg' : 'Invalid symbol.'}
+                bids, asks = self.book(asset, venue, int(query.get('limit', 100)))
+                return 200, {'lastUpdateId' : 1, 'bids' : [[str(price), str(size)] for price, size in bids], 'asks' : [[str(price), str(size)] for price, size in asks]}
+
+        if host == 'api.bybit.com' :
+            if path == '/v5/market/tickers' :
+                tickers = []
+                for asset in self.listed('bybit') :
+                    price = self.price(asset, 'bybit')
+                    tickers.append({'symbol' : asset + 'USDT', 'bid1Price' : str(price * 0.9995), 'ask1Price' : str(price * 1.0005), 'lastPrice' : str(price)})
+                return 200, {'retCode' : 0, 'result' : {'category' : 'spot', 'list' : tickers}}
+
+            if path == '/v2/public/orderBook/L2' :
+                asset = self.asset_of('bybit', query.get('symbol'))
+                if asset is None :
+                    return 200, {'ret_code' : 0, 'result' : []}
+                bids, asks = self.book(asset, 'bybit', 25)
+                result = [{'symbol' : query['symbol'], 'price' : str(price), 'size' : size, 'side' : 'Buy'} for price, size in bids]
+                result += [{'symbol' : query['symbol'], 'price' : str(price), 'size' : size, 'side' : 'Sell'} for price, size in asks]
+                return 200, {'ret_code' : 0, 'result' : result}
+
+        if host == 'api.bitget.com' :
+            if path == '/api/spot/v1/market/tickers' :
+                tickers = []
+                for asset in self.listed('bitget') :
+                    price = self.price(asset, 'bitget')
+                    tickers.append({'symbol' : asset + 'USDT', 'buyOne' : str(price * 0.9995), 'sellOne' : str(price * 1.0005), 'close' : str(price)})
+                return 200, {'code' : '00000', 'data' : tickers}
+
+            if path == '/api/v2/spot/market/orderbook' :
+                asset = self.asset_of('bitget', query.get('symbol'))
+                if asset is None :
+                    return 400, {'code' : '40034', 'msg' : 'Parameter does not exist'}
+                bids, asks = self.book(asset, 'bitget', int(query.get('limit', 150)))
+                return 200, {'code' : '00000', 'data' : {'bids' : [[str(price), str(size)] for price, size in bids], 'asks' : [[str(price), str(size)] for price, size in asks]}}
+
+        return 404, {'error' : 'no stub for ' + host + path}
+
+    def handler (self) :
+        stub = self
+
+        class Handler (BaseHTTPRequestHandler) :
+            # keep-alive, so the connection pools of main.py behave like against the exchanges
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET (self) :
+                parts = urllib.parse.urlsplit(self.path)
+                host, _, path = parts.path.lstrip('/').partition('/')
+                query = dict(urllib.parse.parse_qsl(parts.query))
+
+                with stub.lock :
+                    stub.requests[host] = stub.requests.get(host, 0) + 1
+
+                time.sleep(max(0, stub.latency + random.uniform(-stub.jitter, stub.jitter)))
+
+                if host != 'api.telegram.org' and random.random() < stub.rate_429 :
+                    with stub.lock :
+                        stub.responses_429 += 1
+                    self.send_body(429, {'code' : 429, 'msg' : 'Too many requests'}, {'Retry-After' : str(stub.retry_after)})
+                    return
+
+                status, payload = stub.respond(host, '/' + path, query)
+                self.send_body(status, payload)
+
+            def send_body (self, status, payload, headers={}) :
+                body = json.dumps(payload).encode()
+
+                with stub.lock :
+                    stub.bytes_sent += len(body)
+
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in headers.items() :
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message (self, format, *args) :
+                pass
+
+        return Handler
+
+    def start (self) :
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler())
+        self.server.daemon_threads = True
+        # pooled connections closed by main.py between stages, not worth a traceback
+        self.server.handle_error = lambda request, client_address : None
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        return 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    def stop (self) :
+        self.server.shutdown()
+        self.server.server_close()
+
+    def counters (self) :
+        with self.lock :
+            return sum(self.requests.values()), self.responses_429, self.bytes_sent
+
+
+def use_stub (stub, snapshot, rate_limits=False) :
+    '''
+    Points main.py at the stub and resets everything a previous run could have cached.
+    The exchange rate comes from the snapshot instead of mongo, through the same cache get_exchange_rate fills.
+    '''
+
+    main.API_BASE_URL = stub.start()
+
+    main.reset_runtime()
+    main.EXCHANGE_RATE_CACHE['exchange_rate'] = snapshot['krw_usd']
+    main.EXCHANGE_RATE_CACHE['expires'] = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+
+    # without the exchanges' limits the harness measures the code, not the pacing. The stub still injects 429s
+    for limiter in main.RATE_LIMITERS.values() :
+        limiter.limit = main.RATE_LIMITS[limiter.exchange]['limit'] if rate_limits else 10 ** 9
+        limiter.used = 0
+        limiter.blocked_until = 0
+
+
+@contextlib.contextmanager
+def stage_timer (stages, module, name) :
+    '''
+    Temporarily wraps module.name so the time spent in it is added to stages[name], calls made under tracemalloc aren't counted.
+    '''
+
+    func = getattr(module, name)
+
+    def timed (*args, **kwargs) :
+        start_time = time.perf_counter()
+        try :
+            return func(*args, **kwargs)
+        finally :
+            if not tracemalloc.is_tracing() :
+                stages[name] = stages.get(name, 0) + time.perf_counter() - start_time
+
+    setattr(module, name, timed)
+    try :
+        yield
+    finally :
+        setattr(module, name, func)
+
+
+def measure (stub, func, memory=True) :
+    '''
+    Runs func once for the time and the request counts, and again under tracemalloc for the peak memory (tracemalloc slows the run down).
+    Output of func is silenced, the prints are still part of the time.
+    '''
+
+    requests_before, responses_429_before, bytes_before = stub.counters()
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull) :
+        start_time = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start_time
+
+        requests_after, responses_429_after, bytes_after = stub.counters()
+        peak = None
+
+        if memory :
+            tracemalloc.start()
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    return {
+        'seconds' : seconds,
+        'requests' : requests_after - requests_before,
+        '429s' : responses_429_after - responses_429_before,
+        'mb_received' : (bytes_after - bytes_before) / 1e6,
+        'peak_mb' : peak / 1e6 if peak is not None else None,
+        'result' : result
+    }
+
+
+def benchmark_collector (stub, exchange) :
+    '''
+    get_prices_<exchange> split into the stages of its collector : ticker list, orderbook fetch, dataframe build.
+    '''
+
+    get_tickers, orderbook_jobs, build_df = main.COLLECTORS[exchange]
+    stages = {}
+
+    def get_prices () :
+        times = [time.perf_counter()]
+
+        ticker_list = get_tickers() if get_tickers else None
+        times.append(time.perf_counter())
+
+        outputs = main.fetch_orderbooks(orderbook_jobs(ticker_list))
+        times.append(time.perf_counter())
+
+        df = build_df(outputs)
+        times.append(time.perf_counter())
+
+        # the traced run of measure is only there for the memory
+        if not tracemalloc.is_tracing() :
+            stages.update(zip(['tickers', 'orderbooks', 'build_df'], [end - start for start, end in zip(times, times[1:])]))
+
+        return df
+
+    result = measure(stub, get_prices)
+    result['stages'] = stages
+    result['rows'] = len(result.pop('result'))
+
+    return result
+
+
+def benchmark_execute (stub) :
+    '''
+    execute with the time spent in each of its stages, the telegram flush included since the Lambda handler waits for it.
+    '''
+
+    stages = {}
+
+    def run () :
+        # a fresh alert state, otherwise the repeated run sends nothing
+        main.ALERT_STATE = main.AlertState()
+        main.execute('testing')
+
+        main.TELEGRAM.flush()
+
+    with stage_timer(stages, main, 'collect_prices'), stage_timer(stages, main, 'build_venue_table'), stage_timer(stages, main, 'check_venue_table'), stage_timer(stages, main.TELEGRAM, 'flush') :
+        result = measure(stub, run)
+
+    result['stages'] = stages
+    result['rows'] = None
+    result.pop('result')
+
+    return result
+
+
+def check_daemon_frames (snapshot) :
+    '''
+    Offline check of the daemon's base frames : books keyed by asset, as stream_orderbooks keeps them, go through daemon_base_frame like in run_daemon_async.
+    Every streamed asset has to come out under its own name with its levels, and ETH has to be there for the exit discount.
+    '''
+
+    stub = StubExchange(snapshot)
+
+    for exchange in main.BASE_EXCHANGES :
+        books = {asset : stub.book(asset, exchange, 15) for asset in stub.listed(exchange)}
+
+        df = main.daemon_base_frame(exchange, books, set(books), snapshot['krw_usd'])
+
+        assert set(df['base_ticker']) == set(books), '{} daemon frame lost assets : {}'.format(exchange, sorted(set(books) - set(df['base_ticker'].dropna()))[:10])
+        assert 'ETH' in set(df['base_ticker']), '{} daemon frame has no ETH'.format(exchange)
+        assert df['bids'].map(len).gt(0).all(), '{} daemon frame has books without levels'.format(exchange)
+
+        print('{} daemon frame - {} assets ok'.format(exchange, len(df)))
+
+
+def check_daemon_alerts (snapshot, against_exchange='binance', timeout=30) :
+    '''
+    Offline check of run_daemon_async : a local websocket stand-in plays the upbit and bithumb orderbook streams, the exchanges compared against come from a StubExchange.
+    Every book is sent without premium except one asset at 4 %, which passes screening without triggering. Once the daemon ran a check round on an exchange,
+    that asset moves to 8 % there, and the move has to be alerted on both exchanges.
+    '''
+
+    snapshot = {'krw_usd' : snapshot['krw_usd'], 'assets' : {asset : dict(market, premium=0) for asset, market in snapshot['assets'].items()}}
+
+    target = next(asset for asset, market in snapshot['assets'].items() if asset != 'ETH' and set(main.BASE_EXCHANGES + [against_exchange]) <= set(market['venues']))
+    snapshot['assets'][target].update(premium=0.04, depth_usd=3e6)
+
+    stub = StubExchange(snapshot, latency=0.001, jitter=0)
+    use_stub(stub, snapshot)
+
+    rounds = {}
+    alerts = {}
+    check_price_diff = main.check_price_diff
+
+    def counted_check (df_base, df_against, base_name, *args, **kwargs) :
+        df = check_price_diff(df_base, df_against, base_name, *args, **kwargs)
+        rounds[base_name] = rounds.get(base_name, 0) + 1
+        alerts[base_name] = alerts.get(base_name, 0) + int(df.loc[df['base_ticker'] == target, 'alert'].sum())
+        return df
+
+    def orderbook_message (asset, exchange) :
+        bids, asks = stub.book(asset, exchange, 15)
+        units = [{'ask_price' : ask[0], 'bid_price' : bid[0], 'ask_size' : ask[1], 'bid_size' : bid[1]} for bid, ask in zip(bids, asks)]
+        return {'type' : 'orderbook', 'code' : 'KRW-' + asset, 'orderbook_units' : units}
+
+    async def feed (request) :
+        exchange = request.match_info['exchange']
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+
+        subscription = json.loads((await ws.receive()).data)
+        for market in subscription[1]['codes'] :
+            await ws.send_json(orderbook_message(market.replace('KRW-', ''), exchange))
+
+        # the move only arrives after the first check round of the exchange
+        while not rounds.get(main.EXCHANGE_NAMES[exchange]) :
+            await asyncio.sleep(0.1)
+
+        snapshot['assets'][target]['premium'] = 0.08
+        await ws.send_json(orderbook_message(target, exchange))
+
+        async for msg in ws :
+            pass
+
+        return ws
+
+    async def run () :
+        app = web.Application()
+        app.router.add_get('/{exchange}', feed)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+
+        url = 'ws://127.0.0.1:{}/'.format(runner.addresses[0][1])
+        for exchange in main.BASE_EXCHANGES :
+            os.environ[main.WEBSOCKET_FEEDS[exchange][0]] = url + exchange
+
+        daemon = asyncio.ensure_future(main.run_daemon_async('testing', [against_exchange], 5, 10000, 10000, use_depth_cache=False))
+        deadline = time.time() + timeout
+
+        while time.time() < deadline and not all(alerts.get(main.EXCHANGE_NAMES[exchange]) for exchange in main.BASE_EXCHANGES) :
+            await asyncio.sleep(0.1)
+
+        daemon.cancel()
+        await asyncio.gather(daemon, return_exceptions=True)
+        await runner.cleanup()
+
+    main.check_price_diff = counted_check
+    try :
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull) :
+            # the loop the pooled sessions live on, like run_daemon
+            main.get_event_loop().run_until_complete(run())
+            main.TELEGRAM.flush()
+    finally :
+        main.check_price_diff = check_price_diff
+        for exchange in main.BASE_EXCHANGES :
+            os.environ.pop(main.WEBSOCKET_FEEDS[exchange][0], None)
+        main.close_http_sessions()
+        stub.stop()
+
+    for exchange in main.BASE_EXCHANGES :
+        name = main.EXCHANGE_NAMES[exchange]
+        assert rounds.get(name), '{} daemon ran no check round'.format(exchange)
+        assert alerts.get(name), '{} daemon missed the move of {} after the first check round ({} check rounds)'.format(exchange, target, rounds[name])
+
+        print('{} daemon alert - {} alerted after {} check rounds ok'.format(exchange, target, rounds[name]))
+
+
+def print_result (label, result) :
+    throughput = result['requests'] / result['seconds'] if result['seconds'] else 0
+    rows = '' if result['rows'] is None else result['rows']
+
+    print('{:<24} {:>9.3f} {:>9} {:>6} {:>9.1f} {:>9.2f} {:>7} {:>9.1f}'.format(
+        label, result['seconds'], result['requests'], result['429s'], throughput, result['mb_received'], rows, result['peak_mb']
+    ))
+
+    for name, seconds in result['stages'].items() :
+        print('    {:<20} {:>9.3f}'.format(name, seconds))
+
+
+def benchmark_end_to_end (snapshot, scales=(1, 10), exchanges=('upbit', 'bithumb', 'binance', 'bybit', 'bitget', 'mexc'), latency=0.02, jitter=0.01, rate_429=0.0, retry_after=0, rate_limits=False) :
+    '''
+    Runs each get_prices_* and execute against a StubExchange serving snapshot, with the symbol universe scaled by every factor of scales.
+    execute is run cold (empty symbol universe) and warm (universe cached by the cold run).
+    '''
+
+    for factor in scales :
+        scaled = scale_snapshot(snapshot, factor)
+        stub = StubExchange(scaled, latency, jitter, rate_429, retry_after)
+        use_stub(stub, scaled, rate_limits)
+
+        print('\n{} assets ({}x), latency {} s +- {} s, {:.0%} 429s'.format(len(scaled['assets']), factor, latency, jitter, rate_429))
+        print('{:<24} {:>9} {:>9} {:>6} {:>9} {:>9} {:>7} {:>9}'.format('', 'seconds', 'requests', '429s', 'req / s', 'MB in', 'rows', 'peak MB'))
+
+        try :
+            for exchange in exchanges :
+                print_result('get_prices_' + exchange, benchmark_collector(stub, exchange))
+
+            # measure runs execute twice, the first run of the next call finds the universe of the previous one
+            main.reset_runtime()
+            main.EXCHANGE_RATE_CACHE['exchange_rate'] = scaled['krw_usd']
+            main.EXCHANGE_RATE_CACHE['expires'] = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+
+            print_result('execute', benchmark_execute(stub))
+
+        finally :
+            stub.stop()
+            main.close_http_sessions()
+
+
+if __name__ == '__main__' :
+    parser = argparse.ArgumentParser(description='frame build benchmark, and end to end runs against a local stub of the exchanges')
+    parser.add_argument('--frames', action='store_true', help='only run the frame build benchmark')
+    parser.add_argument('--record', metavar='NAME', help='record a snapshot of the live exchanges into benchmark_fixtures/NAME.json and exit')
+    parser.add_argument('--snapshot', metavar='NAME', help='replay benchmark_fixtures/NAME.json instead of a synthetic snapshot')
+    parser.add_argument('--assets', type=int, default=250, help='korean listings of the synthetic snapshot')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10])
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--rate-429', type=float, default=0.0, help='share of exchange requests answered with a 429')
+    parser.add_argument('--retry-after', type=float, default=0)
+    parser.add_argument('--rate-limits', action='store_true', help='pace requests with the real rate limits')
+    parser.add_argument('--check-daemon', action='store_true', help='only check the daemon base frames built from streamed books, and the alerts of the daemon against a local websocket stand-in')
+    args = parser.parse_args()
+
+    if args.frames :
+        benchmark_frame_build()
+
+    elif args.record :
+        record_snapshot(args.record)
+
+    elif args.check_daemon :
+        snapshot = load_snapshot(args.snapshot) if args.snapshot else synthetic_snapshot(args.assets)
+        check_daemon_frames(snapshot)
+        check_daemon_alerts(snapshot)
+
+    else :
+        snapshot = load_snapshot(args.snapshot) if args.snapshot else synthetic_snapshot(args.assets)
+        benchmark_end_to_end(snapshot, args.scales, latency=args.latency, jitter=args.jitter, rate_429=args.rate_429, retry_after=args.retry_after, rate_limits=args.rate_limits)
@@ -3,6 +3,7 @@ import json
 import time 
 import os 
 import datetime 
+import pymongo
 from pymongo import MongoClient
 
 
@@ -38,6 +39,9 @@ def write_sql (exchange_rate) :
         data = {"dateCreated": timestamp, "exchange_rate": exchange_rate}
         collection.insert_one(data)
 
+        # main.py reads the latest rate by dateCreated, no-op once the index exists 
+        collection.create_index([("dateCreated", pymongo.DESCENDING)])
+
     except Exception as e:
         print(e)
 
@@ -2,623 +2,3632 @@ import requests
 import json 
 import time 
 import pandas as pd 
+import numpy as np 
 import os 
+import pymongo
 from pymongo import MongoClient
+import asyncio
+import aiohttp
+import urllib.parse
 import threading
-import concurrent.futures
+import zlib
+import random
+import datetime
+import atexit
+import bisect
+import contextlib
+import queue
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 
 
 def timing_decorator(func):
     '''
-    Script is ran every minute, so it is important to know how long the code takes to run 
+    Script is ran every minute, so it is important to know how long the code takes to run. Also recorded as the stage_seconds metric of the function. 
     '''
     def wrapper(*args, **kwargs):
         start_time = time.time()
         result = func(*args, **kwargs)
         end_time = time.time()
         execution_time = end_time - start_time
+        METRICS.observe('stage_seconds', execution_time, stage=func.__name__)
         print(f"{func.__name__} took {execution_time} seconds to execute")
         return result
     return wrapper
 
 
-def thread_func (func, max_threads, *args) : 
-    """
-    Takes a function, and parameters in a list, enables threading with a cap on the number of threads running. Some API's limit the number of API queries concurrently.
-    """
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_threads) as executor:
-        results = executor.map(func, *args)    
+# histogram buckets in seconds, for the request latencies and the stage durations 
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# raw values kept per metric for the EMF lines, CloudWatch takes up to 100 values per metric in one line 
+EMF_MAX_SAMPLES = 100
+
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'UpbitArbNotif')
+
+# port of the prometheus endpoint of the daemon, 0 turns it off 
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 9108))
+
+# address the prometheus endpoint binds to, only reachable from the same host by default. 0.0.0.0 exposes it to a scraper on another machine 
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+
+METRIC_UNITS = {
+    'requests_total' : 'Count', 
+    'retries_total' : 'Count', 
+    'dropped_total' : 'Count', 
+    'bytes_received_total' : 'Bytes', 
+    'request_seconds' : 'Seconds', 
+    'stage_seconds' : 'Seconds'
+}
+
+
+class Metrics : 
+    '''
+    Counters and histograms of the process, labelled by exchange / status / stage. A lock and a few dictionary updates per request, cheap enough to always keep on. 
+
+    counters : requests_total (exchange, status), retries_total (exchange, reason), dropped_total (exchange, reason), bytes_received_total (exchange) 
+    histograms : request_seconds (exchange), stage_seconds (stage, and exchange for the per exchange stages) 
+
+    A Lambda invocation prints them as CloudWatch Embedded Metric Format lines at the end (emit_emf, which starts the counts over), 
+    the daemon serves the running totals in the prometheus text format (prometheus_text). 
+    '''
+
+    def __init__ (self) : 
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset (self) : 
+        self.counters = {}
+        self.histograms = {}
+
+    def inc (self, name, value=1, **labels) : 
+        key = (name, tuple(sorted((label, str(label_value)) for label, label_value in labels.items())))
+
+        with self.lock : 
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe (self, name, value, **labels) : 
+        key = (name, tuple(sorted((label, str(label_value)) for label, label_value in labels.items())))
+
+        with self.lock : 
+            histogram = self.histograms.get(key)
+
+            if histogram is None : 
+                # one more bucket for the values above the last bound 
+                histogram = {'buckets' : [0] * (len(METRIC_BUCKETS) + 1), 'sum' : 0, 'count' : 0, 'samples' : []}
+                self.histograms[key] = histogram
+
+            histogram['buckets'][bisect.bisect_left(METRIC_BUCKETS, value)] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+            # reservoir sample, an even pick of the values however many there are 
+            if len(histogram['samples']) < EMF_MAX_SAMPLES : 
+                histogram['samples'].append(value)
+            else : 
+                i = random.randrange(histogram['count'])
+                if i < EMF_MAX_SAMPLES : 
+                    histogram['samples'][i] = value
+
+    @contextlib.contextmanager
+    def stage (self, stage, **labels) : 
+        start_time = time.perf_counter()
+        try : 
+            yield
+        finally : 
+            self.observe('stage_seconds', time.perf_counter() - start_time, stage=stage, **labels)
+
+    def emf_lines (self) : 
+        '''
+        One EMF json line per label set, with every metric recorded under those labels. Histograms are sent as their sampled values so CloudWatch can compute percentiles. 
+        '''
+
+        timestamp = int(time.time() * 1000)
+        groups = {}
+
+        with self.lock : 
+            for (name, labels), value in self.counters.items() : 
+                groups.setdefault(labels, {})[name] = value
+
+            for (name, labels), histogram in self.histograms.items() : 
+                groups.setdefault(labels, {})[name] = list(histogram['samples'])
+
+        lines = []
+
+        for labels, values in groups.items() : 
+            line = {
+                '_aws' : {
+                    'Timestamp' : timestamp, 
+                    'CloudWatchMetrics' : [{
+                        'Namespace' : METRICS_NAMESPACE, 
+                        'Dimensions' : [[label for label, _ in labels]], 
+                        'Metrics' : [{'Name' : name, 'Unit' : METRIC_UNITS.get(name, 'None')} for name in values]
+                    }]
+                }
+            }
+            line.update(dict(labels))
+            line.update(values)
+
+            lines.append(json.dumps(line))
+
+        return lines
+
+    def emit_emf (self) : 
+        '''
+        Prints the EMF lines, Lambda ships stdout to CloudWatch Logs which extracts the metrics. Starts the counts over for the next invocation. 
+        '''
+
+        for line in self.emf_lines() : 
+            print(line)
+
+        with self.lock : 
+            self.reset()
+
+    def prometheus_text (self) : 
+
+        def label_text (labels, extra=()) : 
+            pairs = ['{}="{}"'.format(label, label_value) for label, label_value in list(labels) + list(extra)]
+            return '{' + ','.join(pairs) + '}' if pairs else ''
+
+        lines = []
+
+        with self.lock : 
+            for name in sorted({name for name, _ in self.counters}) : 
+                lines.append('# TYPE arb_{} counter'.format(name))
+                for (counter_name, labels), value in self.counters.items() : 
+                    if counter_name == name : 
+                        lines.append('arb_{}{} {}'.format(name, label_text(labels), value))
+
+            for name in sorted({name for name, _ in self.histograms}) : 
+                lines.append('# TYPE arb_{} histogram'.format(name))
+                for (histogram_name, labels), histogram in self.histograms.items() : 
+                    if histogram_name != name : 
+                        continue 
+
+                    cumulative = 0
+                    for bound, count in zip(list(METRIC_BUCKETS) + ['+Inf'], histogram['buckets']) : 
+                        cumulative += count
+                        lines.append('arb_{}_bucket{} {}'.format(name, label_text(labels, [('le', bound)]), cumulative))
+
+                    lines.append('arb_{}_sum{} {}'.format(name, label_text(labels), histogram['sum']))
+                    lines.append('arb_{}_count{} {}'.format(name, label_text(labels), histogram['count']))
+
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
+
+
+def metric_label (url) : 
+    '''
+    Exchange of the url for the metric labels, the host itself for anything else (e.g. telegram). 
+    '''
+
+    host = urllib.parse.urlsplit(url).netloc
+
+    return EXCHANGE_HOSTS.get(host, host)
+
+
+def start_metrics_server (port=METRICS_PORT, host=METRICS_HOST) : 
+    '''
+    Serves METRICS in the prometheus text format on host:port/metrics from a background thread. 
+    '''
+
+    class MetricsHandler (BaseHTTPRequestHandler) : 
+        def do_GET (self) : 
+            if self.path != '/metrics' : 
+                self.send_error(404)
+                return 
+
+            body = METRICS.prometheus_text().encode()
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message (self, format, *args) : 
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    print('metrics on {}:{}'.format(host, port))
+
+    return server
+
+
+# max number of orderbook requests in flight per exchange, achieved through trial and error. Request pacing itself is done by RATE_LIMITERS. 
+ORDERBOOK_CONCURRENCY = {
+    'upbit' : 2, 
+    'bithumb' : 10, 
+    'binance' : 20, 
+    'bybit' : 20, 
+    'bitget' : 10, 
+    'mexc' : 10
+}
+
+
+# exchange each API host belongs to, connection pools for the host are sized to the exchange's concurrency. 
+EXCHANGE_HOSTS = {
+    'api.upbit.com' : 'upbit', 
+    'api.bithumb.com' : 'bithumb', 
+    'api.binance.com' : 'binance', 
+    'api.bybit.com' : 'bybit', 
+    'api.bitget.com' : 'bitget', 
+    'api.mexc.com' : 'mexc'
+}
+
+# every REST host can be pointed at a stand-in server, e.g. the stub exchange of benchmark.py. 
+# with API_BASE_URL set, https://api.upbit.com/v1/market/all is requested from API_BASE_URL/api.upbit.com/v1/market/all 
+API_BASE_URL = os.environ.get('API_BASE_URL')
+
+# pooled keep-alive sessions keyed by host. Kept at module level so they are reused across runs in a warm Lambda container. 
+HTTP_SESSIONS = {}
+ASYNC_SESSIONS = {}
+
+# new vs reused connections for the async sessions, the blocking sessions are counted by urllib3 itself. 
+ASYNC_CONNECTION_STATS = {}
+
+EVENT_LOOP = None
+
+# one semaphore per exchange for the whole event loop, so concurrently running collectors share the exchange's budget. 
+ORDERBOOK_SEMAPHORES = {}
+
+
+def pool_size (host) : 
+    return ORDERBOOK_CONCURRENCY.get(EXCHANGE_HOSTS.get(host), 2)
+
+
+def api_url (url) : 
+    '''
+    Where a request for url is actually sent, see API_BASE_URL. Sessions and rate limiters stay keyed by the original host. 
+    '''
+
+    if not API_BASE_URL : 
+        return url
+
+    parts = urllib.parse.urlsplit(url)
+
+    return API_BASE_URL.rstrip('/') + '/' + parts.netloc + parts.path + ('?' + parts.query if parts.query else '')
+
+
+def get_http_session (url) : 
+    '''
+    Returns the keep-alive requests session for the host of the url, creating it on first use. 
+    '''
+
+    host = urllib.parse.urlsplit(url).netloc
+
+    if host not in HTTP_SESSIONS : 
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size(host))
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({"accept": "application/json"})
+        HTTP_SESSIONS[host] = session
+
+    return HTTP_SESSIONS[host]
+
+
+def get_event_loop () : 
+    '''
+    One event loop per process, the async sessions are bound to it so it has to outlive a single run. 
+    '''
+
+    global EVENT_LOOP
+
+    if EVENT_LOOP is None or EVENT_LOOP.is_closed() : 
+        EVENT_LOOP = asyncio.new_event_loop()
+        ASYNC_SESSIONS.clear()
+        ORDERBOOK_SEMAPHORES.clear()
+
+    return EVENT_LOOP
+
+
+def get_async_session (url) : 
+    '''
+    Returns the aiohttp session for the host of the url, creating it on first use. Has to be called from inside the event loop. 
+    '''
+
+    host = urllib.parse.urlsplit(url).netloc
+
+    if host not in ASYNC_SESSIONS or ASYNC_SESSIONS[host].closed : 
+        stats = ASYNC_CONNECTION_STATS.setdefault(host, {'new' : 0, 'reused' : 0})
+
+        async def on_create (session, context, params) : 
+            stats['new'] += 1
+
+        async def on_reuse (session, context, params) : 
+            stats['reused'] += 1
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(on_create)
+        trace_config.on_connection_reuseconn.append(on_reuse)
+
+        connector = aiohttp.TCPConnector(limit_per_host=pool_size(host), keepalive_timeout=60)
+
+        ASYNC_SESSIONS[host] = aiohttp.ClientSession(
+            connector=connector, 
+            headers={"accept": "application/json"}, 
+            timeout=aiohttp.ClientTimeout(total=30), 
+            trace_configs=[trace_config]
+        )
+
+    return ASYNC_SESSIONS[host]
+
+
+def connection_stats () : 
+    '''
+    Number of new and reused connections per host since the process started, if the pools work new should stay close to the pool size. 
+    '''
+
+    stats = {}
+
+    for host, session in HTTP_SESSIONS.items() : 
+        host_stats = stats.setdefault(host, {'new' : 0, 'reused' : 0})
+        for adapter in set(session.adapters.values()) : 
+            pools = adapter.poolmanager.pools
+            for key in pools.keys() : 
+                pool = pools[key]
+                host_stats['new'] += pool.num_connections
+                host_stats['reused'] += pool.num_requests - pool.num_connections
+
+    for host, async_stats in ASYNC_CONNECTION_STATS.items() : 
+        host_stats = stats.setdefault(host, {'new' : 0, 'reused' : 0})
+        host_stats['new'] += async_stats['new']
+        host_stats['reused'] += async_stats['reused']
+
+    return stats
+
+
+# request weight budget per exchange and the length of the window in seconds, taken from each exchange's API docs. 
+# only a share of the budget (RATE_LIMIT_HEADROOM) is used, since the exchange counts every request from the IP, not only ours. 
+RATE_LIMITS = {
+    'upbit' : {'limit' : 10, 'interval' : 1}, 
+    'bithumb' : {'limit' : 135, 'interval' : 1}, 
+    'binance' : {'limit' : 6000, 'interval' : 60}, 
+    'bybit' : {'limit' : 600, 'interval' : 5}, 
+    'bitget' : {'limit' : 20, 'interval' : 1}, 
+    'mexc' : {'limit' : 500, 'interval' : 10}
+}
+
+RATE_LIMIT_HEADROOM = 0.9
+
+# number of times a request is retried after a 429 / 418 before giving up on it 
+RATE_LIMIT_RETRIES = 3
+
+
+def limit_from_headers (exchange, headers) : 
+    '''
+    Reads the rate limit headers returned by the exchange, returns (used, limit) for the current window. Either can be None when the exchange does not report it. 
+    '''
+
+    try : 
+        if exchange == 'upbit' : 
+            # Remaining-Req : group=orderbook; min=1800; sec=9 
+            remaining = headers.get('Remaining-Req')
+            if remaining : 
+                fields = dict(field.strip().split('=') for field in remaining.split(';'))
+                return RATE_LIMITS['upbit']['limit'] - int(fields['sec']), None
+
+        elif exchange == 'binance' : 
+            used = headers.get('X-MBX-USED-WEIGHT-1M') or headers.get('X-MBX-USED-WEIGHT')
+            if used : 
+                return int(used), None
+
+        elif exchange == 'bybit' : 
+            remaining = headers.get('X-Bapi-Limit-Status')
+            limit = headers.get('X-Bapi-Limit')
+            if remaining and limit : 
+                return int(limit) - int(remaining), int(limit)
+
+        elif exchange == 'bitget' : 
+            remaining = headers.get('x-mw-ratelimit-remaining')
+            limit = headers.get('x-mw-ratelimit-limit')
+            if remaining and limit : 
+                return int(limit) - int(remaining), int(limit)
+
+    # malformed headers should never fail the request itself 
+    except (ValueError, KeyError) : 
+        pass
+
+    return None, None
+
+
+class RateLimiter : 
+    '''
+    Tracks the weight used by one exchange in fixed windows aligned to the clock, which is how the exchanges count it. 
+
+    Requests are paced so the window budget is used up but never exceeded, and the count is corrected with the headers the exchange sends back. 
+    After a 429 / 418 every request to the exchange waits until the backoff is over. 
+    '''
+
+    def __init__ (self, exchange) : 
+        self.exchange = exchange
+        self.limit = RATE_LIMITS[exchange]['limit']
+        self.interval = RATE_LIMITS[exchange]['interval']
+        self.window = None
+        self.used = 0
+        self.blocked_until = 0
+        self.backoffs = 0
+        # the blocking call_api runs in worker threads alongside the event loop 
+        self.lock = threading.Lock()
+
+    def roll (self) : 
+        window = int(time.time() // self.interval)
+        if window != self.window : 
+            self.window = window
+            self.used = 0
+
+    def wait_time (self, weight) : 
+        '''
+        Seconds to wait before a request of the given weight can be sent, 0 if it can be sent now (and counts it). 
+        '''
+
+        with self.lock : 
+            now = time.time()
+
+            if now < self.blocked_until : 
+                return self.blocked_until - now
+
+            self.roll()
+
+            if self.used + weight <= self.limit * RATE_LIMIT_HEADROOM : 
+                self.used += weight
+                return 0
+
+            return (self.window + 1) * self.interval - now
+
+    async def acquire (self, weight=1) : 
+        while True : 
+            wait = self.wait_time(weight)
+            if wait <= 0 : 
+                return
+            await asyncio.sleep(wait)
+
+    def acquire_blocking (self, weight=1) : 
+        while True : 
+            wait = self.wait_time(weight)
+            if wait <= 0 : 
+                return
+            time.sleep(wait)
+
+    def update (self, status, headers) : 
+        '''
+        The exchange's own count also includes requests we did not make through this limiter (other processes on the same IP, retries), so the higher count wins. 
+        '''
+
+        if status == 200 : 
+            self.backoffs = 0
+
+        used, limit = limit_from_headers(self.exchange, headers)
+
+        if limit : 
+            self.limit = limit
+
+        if used is not None : 
+            with self.lock : 
+                self.roll()
+                self.used = max(self.used, used)
+
+    def backoff (self, status, headers) : 
+        '''
+        429 is a rate limit warning, 418 is Binance's IP ban after ignoring 429s, both come with Retry-After in seconds. 
+        Without the header the wait doubles with every consecutive backoff. 
+        '''
+
+        self.backoffs += 1
+
+        try : 
+            retry_after = float(headers.get('Retry-After'))
+        except (TypeError, ValueError) : 
+            retry_after = min(self.interval * 2 ** (self.backoffs - 1), 60)
+
+        self.blocked_until = max(self.blocked_until, time.time() + retry_after)
+        print('{} returned {}, backing off for {:.1f} seconds'.format(self.exchange, status, retry_after))
+
+
+RATE_LIMITERS = {exchange : RateLimiter(exchange) for exchange in RATE_LIMITS}
+
+
+def get_rate_limiter (url) : 
+    return RATE_LIMITERS.get(EXCHANGE_HOSTS.get(urllib.parse.urlsplit(url).netloc))
+
+
+def orderbook_job (exchange, url, ticker, parser, weight=1, **kwargs) : 
+    '''
+    Describes a single orderbook request for the fetch engine. 
+
+    parser is called with (ticker, json_object) once the response arrives, weight is what the request counts against the exchange's rate limit, kwargs are the URL parameters. 
+    '''
+
+    return {
+        'exchange' : exchange, 
+        'url' : url, 
+        'ticker' : ticker, 
+        'parser' : parser, 
+        'weight' : weight, 
+        'params' : kwargs
+    }
+
+
+async def call_api_async (url, weight=1, **kwargs) : 
+    '''
+    Async version of call_api, goes through the pooled aiohttp session of the host instead of opening a new connection for every request. 
+
+    Requests are paced by the exchange's rate limiter, 429 / 418 responses back off and retry instead of failing. 
+    '''
+
+    session = get_async_session(url)
+    limiter = get_rate_limiter(url)
+    exchange = metric_label(url)
+
+    for attempt in range(RATE_LIMIT_RETRIES + 1) : 
+        if limiter : 
+            await limiter.acquire(weight)
+
+        start_time = time.perf_counter()
+
+        try : 
+            response = await session.get(api_url(url), params=kwargs)
+        # keep-alive connections can be dropped by the exchange while the Lambda container is frozen, retry once on a fresh one 
+        except aiohttp.ServerDisconnectedError : 
+            METRICS.inc('retries_total', exchange=exchange, reason='disconnected')
+            response = await session.get(api_url(url), params=kwargs)
+
+        async with response : 
+            body = await response.read()
+
+            METRICS.observe('request_seconds', time.perf_counter() - start_time, exchange=exchange)
+            METRICS.inc('requests_total', exchange=exchange, status=response.status)
+            METRICS.inc('bytes_received_total', len(body), exchange=exchange)
+
+            if limiter : 
+                limiter.update(response.status, response.headers)
+
+            if response.status == 200 : 
+                return json.loads(body)
+
+            if response.status not in (429, 418) : 
+                break 
+
+            if attempt < RATE_LIMIT_RETRIES : 
+                METRICS.inc('retries_total', exchange=exchange, reason=response.status)
+
+            if limiter : 
+                limiter.backoff(response.status, response.headers)
+            else : 
+                await asyncio.sleep(2 ** attempt)
+
+    else : 
+        # still rate limited after every retry, reported in the logs instead of a telegram message per ticker 
+        print('Rate limited : ' + url)
+        return {"error": "API request failed", "name": "too_many_requests"}
+
+    tg_notif('API Req Failed : ' + url, 'testing')
+    return {"error": "API request failed"}
+
+
+async def fetch_orderbooks_async (jobs) : 
+    '''
+    Runs every job on one event loop, capping the number of requests in flight per exchange with ORDERBOOK_CONCURRENCY. 
+    '''
+
+    for exchange, max_concurrency in ORDERBOOK_CONCURRENCY.items() : 
+        if exchange not in ORDERBOOK_SEMAPHORES : 
+            ORDERBOOK_SEMAPHORES[exchange] = asyncio.Semaphore(max_concurrency)
+
+    async def run_job (job) : 
+        async with ORDERBOOK_SEMAPHORES[job['exchange']] : 
+            try : 
+                json_object = await call_api_async(job['url'], job['weight'], **job['params'])
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e : 
+                print(job['exchange'], job['ticker'], 'request error :', e)
+                return None
+
+        try : 
+            with METRICS.stage('parse', exchange=job['exchange']) : 
+                return job['parser'](job['ticker'], json_object)
+        # a broken orderbook should not take down every other request on the loop 
+        except Exception as e : 
+            print(job['exchange'], job['ticker'], 'parse error :', e)
+            return None
+
+    return await asyncio.gather(*[run_job(job) for job in jobs])
+
+
+def fetch_orderbooks (jobs) : 
+    '''
+    Takes a list of orderbook jobs (can be from different exchanges), returns the parsed outputs in the same order as the jobs. 
+    '''
+
+    return get_event_loop().run_until_complete(fetch_orderbooks_async(jobs))
+
+
+def call_api (url, **kwargs) : 
+    '''
+    A general use api call function that is able to take in any number of parameters in json format (including no parameters)
+
+    kwargs is in format of a dictionary with key value pairs or the URL parameters. 
+    '''
+
+    limiter = get_rate_limiter(url)
+    exchange = metric_label(url)
+
+    for attempt in range(RATE_LIMIT_RETRIES + 1) : 
+        if limiter : 
+            limiter.acquire_blocking()
+
+        start_time = time.perf_counter()
+
+        # if kwargs is not inputted, then kwargs = {}. {} is an acceptable input for params=
+        response = get_http_session(url).get(api_url(url), params=kwargs)
+
+        METRICS.observe('request_seconds', time.perf_counter() - start_time, exchange=exchange)
+        METRICS.inc('requests_total', exchange=exchange, status=response.status_code)
+        METRICS.inc('bytes_received_total', len(response.content), exchange=exchange)
+
+        if limiter : 
+            limiter.update(response.status_code, response.headers)
+
+        if response.status_code not in (429, 418) : 
+            break 
+
+        if attempt < RATE_LIMIT_RETRIES : 
+            METRICS.inc('retries_total', exchange=exchange, reason=response.status_code)
+
+        if limiter : 
+            limiter.backoff(response.status_code, response.headers)
+        else : 
+            time.sleep(2 ** attempt)
+    
+    # Handle the response and return data as needed.
+    if response.status_code == 200:
+        return response.json()
+    elif response.status_code in (429, 418) : 
+        print('Rate limited : ' + url)
+        return {"error": "API request failed", "name": "too_many_requests"}
+    else:
+        tg_notif('API Req Failed : ' + url, 'testing')
+        return {"error": "API request failed"}
+    
+    # convert (usually response is in non JSON form) to json object first 
+    json_object = json.loads(response.text) 
+
+    return json_object  
+
+
+# telegram group of each destination, anything other than real_time goes to the alternate group for testing purposes 
+TELEGRAM_CHAT_IDS = {
+    'real_time' : '-911570737', 
+    'testing' : '-4051618653'
+}
+
+# telegram rejects longer messages 
+TELEGRAM_MAX_LENGTH = 4096
+
+# how long the sender waits for more alerts before sending, so alerts raised together go out as one message 
+TELEGRAM_COALESCE_DELAY = 1
+
+# attempts per message before it is put back for the next batch, and how long flush waits for the queue to empty 
+TELEGRAM_RETRIES = 3
+TELEGRAM_FLUSH_TIMEOUT = 15
+
+# batches a failed message is put back for before it is dropped, and the most messages queued, the oldest go first during a long outage 
+TELEGRAM_MAX_BATCHES = 5
+TELEGRAM_MAX_PENDING = 1000
+
+
+def split_message (message) : 
+    '''
+    Splits a message longer than TELEGRAM_MAX_LENGTH on line breaks, lines that are too long on their own are cut. 
+    '''
+
+    chunks = ['']
+
+    for line in message.split('\n') : 
+        while len(line) > TELEGRAM_MAX_LENGTH : 
+            chunks.append(line[:TELEGRAM_MAX_LENGTH])
+            line = line[TELEGRAM_MAX_LENGTH:]
+
+        if chunks[-1] and len(chunks[-1]) + 1 + len(line) > TELEGRAM_MAX_LENGTH : 
+            chunks.append(line)
+        else : 
+            chunks[-1] = chunks[-1] + '\n' + line if chunks[-1] else line
+
+    return [chunk for chunk in chunks if chunk]
+
+
+def coalesce_messages (messages) : 
+    '''
+    Merges messages into as few as fit within TELEGRAM_MAX_LENGTH, in order and separated by a blank line. 
+    '''
+
+    merged = []
+
+    for message in messages : 
+        for chunk in split_message(message) : 
+            if merged and len(merged[-1]) + 2 + len(chunk) <= TELEGRAM_MAX_LENGTH : 
+                merged[-1] = merged[-1] + '\n\n' + chunk
+            else : 
+                merged.append(chunk)
+
+    return merged
+
+
+class TelegramDispatcher : 
+    '''
+    Outbound telegram queue. tg_notif only queues the message, a background thread merges what is queued per destination with coalesce_messages and sends it. 
+
+    A send that still fails after TELEGRAM_RETRIES attempts is put back at the front of the queue for the next batch, for up to TELEGRAM_MAX_BATCHES batches. 
+    Messages telegram rejects for good (4xx other than 429) are dropped straight away, and the queue keeps at most TELEGRAM_MAX_PENDING messages. 
+    flush blocks until everything queued so far is sent, it has to be called before a Lambda invocation returns since the container is frozen afterwards. 
+    '''
+
+    def __init__ (self) : 
+        self.pending = []
+        self.sending = False
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def put (self, message, destination) : 
+        with self.condition : 
+            # the number of batches the message failed in goes along with it 
+            self.pending.append((destination, message, 0))
+            self.trim()
+            self.condition.notify_all()
+
+            # started on first use, and again if a previous thread died 
+            if self.thread is None or not self.thread.is_alive() : 
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def trim (self) : 
+        '''
+        Drops the oldest messages beyond TELEGRAM_MAX_PENDING, called with the condition held. 
+        '''
+
+        dropped = len(self.pending) - TELEGRAM_MAX_PENDING
+
+        if dropped > 0 : 
+            print('telegram queue full, dropping the {} oldest messages'.format(dropped))
+            METRICS.inc('dropped_total', dropped, exchange='telegram', reason='queue_full')
+            del self.pending[:dropped]
+
+    def send (self, message, destination) : 
+        '''
+        Sends one message, True once telegram accepted it, None if telegram rejected it for good and False if it is worth trying again later. 
+        '''
+
+        url = "https://api.telegram.org/bot{}/sendMessage".format(os.environ.get('TELEGRAM_KEY'))
+
+        parameters = {
+            'chat_id' : TELEGRAM_CHAT_IDS.get(destination, TELEGRAM_CHAT_IDS['testing']),
+            'text' : message
+            }
+
+        for attempt in range(TELEGRAM_RETRIES) : 
+            try : 
+                start_time = time.perf_counter()
+                response = get_http_session(url).get(api_url(url), params=parameters, timeout=10)
+
+                METRICS.observe('request_seconds', time.perf_counter() - start_time, exchange='telegram')
+                METRICS.inc('requests_total', exchange='telegram', status=response.status_code)
+
+                if response.status_code == 200 : 
+                    return True
+
+                # per chat rate limit, telegram says how long to wait 
+                if response.status_code == 429 : 
+                    time.sleep(response.json().get('parameters', {}).get('retry_after', 2 ** attempt))
+                    continue 
+
+                # bad chat_id, token or text, or the bot was blocked. Sending it again gets the same answer 
+                if 400 <= response.status_code < 500 : 
+                    print('telegram rejected the message, dropping it :', response.status_code, response.text)
+                    METRICS.inc('dropped_total', exchange='telegram', reason=response.status_code)
+                    return None
+
+                print('telegram send failed :', response.status_code, response.text)
+
+            except (requests.exceptions.RequestException, ValueError) as e : 
+                print('telegram send failed :', e)
+
+            time.sleep(2 ** attempt)
+
+        return False
+
+    def run (self) : 
+        while True : 
+            with self.condition : 
+                while not self.pending : 
+                    self.condition.wait()
+
+            # let the rest of the alerts of the run join the batch 
+            time.sleep(TELEGRAM_COALESCE_DELAY)
+
+            with self.condition : 
+                batch = self.pending
+                self.pending = []
+                self.sending = True
+
+            failed = []
+
+            for destination in dict.fromkeys(destination for destination, _, _ in batch) : 
+                messages = coalesce_messages([message for message_destination, message, _ in batch if message_destination == destination])
+                batches = max(batches for message_destination, _, batches in batch if message_destination == destination) + 1
+
+                for i, message in enumerate(messages) : 
+                    if self.send(message, destination) is not False : 
+                        continue 
+
+                    if batches < TELEGRAM_MAX_BATCHES : 
+                        failed.extend((destination, unsent, batches) for unsent in messages[i:])
+                    else : 
+                        print('telegram send failed in {} batches, dropping {} messages'.format(batches, len(messages) - i))
+                        METRICS.inc('dropped_total', len(messages) - i, exchange='telegram', reason='retries')
+                    break 
+
+            with self.condition : 
+                self.pending = failed + self.pending
+                self.trim()
+                self.sending = False
+                self.condition.notify_all()
+
+            # telegram is down, don't spin on the failed messages 
+            if failed : 
+                time.sleep(TELEGRAM_COALESCE_DELAY * 10)
+
+    def flush (self, timeout=TELEGRAM_FLUSH_TIMEOUT) : 
+        '''
+        Waits until every queued message is sent, returns False if some are still unsent after timeout seconds. 
+        '''
+
+        deadline = time.time() + timeout
+
+        with self.condition : 
+            while self.pending or self.sending : 
+                remaining = deadline - time.time()
+
+                if remaining <= 0 : 
+                    print('telegram flush timed out, {} messages unsent'.format(len(self.pending)))
+                    return False
+
+                self.condition.wait(remaining)
+
+        return True
+
+
+TELEGRAM = TelegramDispatcher()
+
+# messages queued by a script run are sent before the process exits 
+atexit.register(TELEGRAM.flush)
+
+
+def tg_notif (message, destination) : 
+    '''
+    Queues a telegram message and returns straight away, see TelegramDispatcher. 
+    '''
+
+    TELEGRAM.put(message, destination)
+
+
+# the exchange rate is written hourly by ex_rate_api.py, a cached rate is kept until the next write is due 
+EXCHANGE_RATE_REFRESH = datetime.timedelta(hours=1)
+
+# grace period for the hourly write to land, and how often to look again when it is late 
+EXCHANGE_RATE_GRACE = datetime.timedelta(minutes=2)
+EXCHANGE_RATE_RETRY = datetime.timedelta(minutes=5)
+
+EXCHANGE_RATE_CACHE = {'exchange_rate' : None, 'expires' : None}
+
+MONGO_CLIENTS = {}
+
+
+def get_mongo_db () : 
+
+    mongo_conn_str = os.environ.get('MONGO_CONN_STR', 'local')
+    db_name = os.environ.get('DB_NAME', 'upbit_tracker')
+    
+    # MongoClient keeps its own connection pool, one per process is enough 
+    if mongo_conn_str not in MONGO_CLIENTS : 
+        MONGO_CLIENTS[mongo_conn_str] = MongoClient(mongo_conn_str)
+
+    return MONGO_CLIENTS[mongo_conn_str][db_name]
+
+
+def get_exchange_rate_collection () : 
+
+    collection_name = os.environ.get('COLLECTION_NAME', 'transactions')
+
+    return get_mongo_db()[collection_name]
+
+
+def get_exchange_rate () : 
+    '''
+    Calling last row from the MongoDB collection, through the dateCreated index instead of reading the whole collection. 
+
+    The rate is cached in the process until the next hourly write is due. 
+    '''
+
+    now = datetime.datetime.utcnow()
+
+    if EXCHANGE_RATE_CACHE['exchange_rate'] is not None and now < EXCHANGE_RATE_CACHE['expires'] : 
+        return EXCHANGE_RATE_CACHE['exchange_rate']
+
+    curr_row = get_exchange_rate_collection().find_one(sort=[('dateCreated', pymongo.DESCENDING)])
+
+    expires = curr_row['dateCreated'] + EXCHANGE_RATE_REFRESH + EXCHANGE_RATE_GRACE
+
+    # the hourly write is late, keep the last rate but look again soon 
+    if expires <= now : 
+        expires = now + EXCHANGE_RATE_RETRY
+
+    EXCHANGE_RATE_CACHE['exchange_rate'] = curr_row['exchange_rate']
+    EXCHANGE_RATE_CACHE['expires'] = expires
+
+    return curr_row['exchange_rate']
+
+
+def pad_levels (books_levels) : 
+    '''
+    Accepts the levels of a batch of books (list of lists of [price, size], as strings or numbers), 
+    returns (prices, sizes) as 2D float arrays with one row per book, padded with NaN to the deepest book. 
+
+    All levels are converted to float in a single call instead of one float() per level. 
+    '''
+
+    counts = np.array([len(levels) for levels in books_levels], dtype=int)
+    depth = counts.max() if len(counts) else 0
+
+    flat = [level[i] for levels in books_levels for level in levels for i in (0, 1)]
+    flat = np.array(flat, dtype=float).reshape(-1, 2)
+
+    prices = np.full((len(books_levels), depth), np.nan)
+    sizes = np.full((len(books_levels), depth), np.nan)
+
+    # row and column of every level in the padded arrays 
+    rows = np.repeat(np.arange(len(books_levels)), counts)
+    cols = np.arange(len(flat)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    prices[rows, cols] = flat[:, 0]
+    sizes[rows, cols] = flat[:, 1]
+
+    return prices, sizes
+
+
+def depth_kernel (bid_prices, bid_sizes, ask_prices, ask_sizes, band=0.02) : 
+    '''
+    Accepts padded level arrays of a batch of books, returns arrays of bid, ask, mid and the liquidity within band of the mid on each side. 
+
+    Bid liquidity is the notional of bids above mid * (1 - band), which is what can be sold on the base exchanges. 
+    Ask liquidity is the notional of asks below mid * (1 + band), which is what can be bought on the exchanges compared against. 
+    '''
+
+    with np.errstate(invalid='ignore') : 
+        bid = np.nanmax(bid_prices, axis=1)
+        ask = np.nanmin(ask_prices, axis=1)
+        mid = (bid + ask) / 2
+
+        bid_lqtt = np.nansum(np.where(bid_prices > mid[:, None] * (1 - band), bid_prices * bid_sizes, 0), axis=1)
+        ask_lqtt = np.nansum(np.where(ask_prices < mid[:, None] * (1 + band), ask_prices * ask_sizes, 0), axis=1)
+
+    return bid, ask, mid, bid_lqtt, ask_lqtt
+
+
+def side_levels (prices, sizes, descending) : 
+    '''
+    Accepts padded level arrays of one side of a batch of books, returns every book's levels as a (levels, 2) array of [price, size], best price first. 
+    These are kept in the dataframes for walk_books. 
+    '''
+
+    # the NaN padding sorts last either way 
+    order = np.argsort(-prices if descending else prices, axis=1)
+    prices = np.take_along_axis(prices, order, axis=1)
+    sizes = np.take_along_axis(sizes, order, axis=1)
+
+    counts = np.sum(~np.isnan(prices), axis=1)
+    levels = np.stack([prices, sizes], axis=2)
+
+    return [row[:count] for row, count in zip(levels, counts)]
+
+
+def stack_levels (levels_list) : 
+    '''
+    pad_levels for the level arrays kept in the dataframes, anything that isn't an array (a ticker missing on the exchange) becomes an empty book. 
+    '''
+
+    return pad_levels([levels if isinstance(levels, np.ndarray) else [] for levels in levels_list])
+
+
+def book_fill (qty, prices, cum_qty, cum_notional) : 
+    '''
+    Accepts a quantity per row and the cumulative quantity and notional of a padded best-first side, both starting with a 0 column. 
+    Returns the notional of filling qty and the price of the next unit after it, NaN once the side is used up. 
+    '''
+
+    # levels filled completely, the next unit comes from the level after them 
+    filled = np.sum(cum_qty[:, 1:] <= qty[:, None], axis=1)
+    rows = np.arange(len(qty))
+
+    depth = prices.shape[1]
+    next_level = np.minimum(filled, depth - 1)
+    next_price = np.where(filled < depth, prices[rows, next_level] if depth else np.nan, np.nan)
+
+    notional = cum_notional[rows, filled] + np.nan_to_num((qty - cum_qty[rows, filled]) * next_price)
+
+    return notional, next_price
+
+
+def walk_books (bid_prices, bid_sizes, ask_prices, ask_sizes, discount) : 
+    '''
+    Accepts padded best-first levels in USD, one row per candidate pair : the bids of the base exchange, the asks of the exchange compared against, 
+    and the ETH exit discount of the pair (base_eth_ask_price_pct, see profit_pct_estimate). 
+
+    Buys on the asks and sells on the bids at the same quantity. The next unit makes bid * (1 - discount) - ask, which only goes down as both books are walked, 
+    so the profit is highest at the first level boundary (of either side) where that stops being positive, found by binary search over the boundaries of every row at once. 
+
+    Returns size_usd (paid for the asks) and profit_usd at that quantity, both 0 when even the first unit isn't profitable. 
+    Only the levels returned by the orderbook requests are walked, a deeper profitable book is capped at them. 
+    '''
+
+    n = len(discount)
+    rows = np.arange(n)
+    zeros = np.zeros((n, 1))
+
+    # cumulative quantity and notional of each side, from 0 
+    bid_qty = np.hstack([zeros, np.cumsum(np.nan_to_num(bid_sizes), axis=1)])
+    ask_qty = np.hstack([zeros, np.cumsum(np.nan_to_num(ask_sizes), axis=1)])
+    bid_notional = np.hstack([zeros, np.cumsum(np.nan_to_num(bid_prices * bid_sizes), axis=1)])
+    ask_notional = np.hstack([zeros, np.cumsum(np.nan_to_num(ask_prices * ask_sizes), axis=1)])
+
+    # level boundaries of both sides, up to where the shallower side runs out 
+    max_qty = np.minimum(bid_qty[:, -1], ask_qty[:, -1])
+    bounds = np.minimum(np.sort(np.hstack([bid_qty, ask_qty]), axis=1), max_qty[:, None])
+
+    def profitable (qty) : 
+        _, bid_next = book_fill(qty, bid_prices, bid_qty, bid_notional)
+        _, ask_next = book_fill(qty, ask_prices, ask_qty, ask_notional)
+        # NaN once a side is used up, which compares False 
+        return bid_next * (1 - discount) > ask_next
+
+    # first boundary where the next unit isn't profitable, there always is one as max_qty uses up a side 
+    lo = np.zeros(n, dtype=int)
+    hi = np.full(n, bounds.shape[1] - 1)
+
+    while np.any(lo < hi) : 
+        mid = (lo + hi) // 2
+        keep_going = profitable(bounds[rows, mid])
+        lo = np.where(keep_going, mid + 1, lo)
+        hi = np.where(keep_going, hi, mid)
+
+    qty = bounds[rows, lo]
+
+    bid_fill, _ = book_fill(qty, bid_prices, bid_qty, bid_notional)
+    ask_fill, _ = book_fill(qty, ask_prices, ask_qty, ask_notional)
+
+    return ask_fill, bid_fill * (1 - discount) - ask_fill
+
+
+def executable_profit (profit_pct, bids, asks, discount) : 
+    '''
+    walk_books for the pairs of a check, as flat arrays with one entry per pair : the top of book profit_pct, object arrays of the base bids and the asks compared against 
+    as kept in the dataframes, and the ETH exit discount. 
+
+    Only pairs with a positive profit_pct can make anything, those are walked in one call. 
+    Returns (size_usd, abs_profit), 0 for the other pairs and NaN where profit_pct is NaN. 
+    '''
+
+    profit_pct = np.asarray(profit_pct, dtype=float)
+    candidate = profit_pct > 0
+
+    size_usd = np.where(np.isnan(profit_pct), np.nan, 0.0)
+    abs_profit = size_usd.copy()
+
+    if candidate.any() : 
+        bid_prices, bid_sizes = stack_levels(bids[candidate])
+        ask_prices, ask_sizes = stack_levels(asks[candidate])
+        discount = np.broadcast_to(np.asarray(discount, dtype=float), profit_pct.shape)[candidate]
+
+        size_usd[candidate], abs_profit[candidate] = walk_books(bid_prices, bid_sizes, ask_prices, ask_sizes, discount)
+
+    return size_usd, abs_profit
+
+
+def flatten_books (outputs) : 
+    '''
+    Orderbook jobs return one book as (ticker, bids, asks), a list of them for batched requests, or None. Returns every book with both sides in one list. 
+    '''
+
+    books = []
+
+    for output in outputs : 
+        if isinstance(output, list) : 
+            books.extend(output)
+        elif output : 
+            books.append(output)
+
+    return [book for book in books if book and len(book[1]) and len(book[2])]
+
+
+def depth_columns (books, side, levels=False) : 
+    '''
+    Runs depth_kernel over a batch of (ticker, bids, asks) books, returns the results as columns (list of tickers and float arrays). 
+
+    side 'bids' returns (tickers, bid, ask, lqtt) for the base exchanges, side 'asks' returns (tickers, curr_price, lqtt) for the exchanges compared against. 
+    With levels the levels of that side are added as a last column, see side_levels. 
+    '''
+
+    books = flatten_books(books)
+
+    if not books : 
+        empty = np.empty(0)
+        columns = ([], empty, empty, empty) if side == 'bids' else ([], empty, empty)
+        return columns + ([],) if levels else columns
+
+    bid_prices, bid_sizes = pad_levels([book[1] for book in books])
+    ask_prices, ask_sizes = pad_levels([book[2] for book in books])
+
+    bid, ask, mid, bid_lqtt, ask_lqtt = depth_kernel(bid_prices, bid_sizes, ask_prices, ask_sizes)
+
+    tickers = [book[0] for book in books]
+
+    if side == 'bids' : 
+        columns = (tickers, bid, ask, bid_lqtt)
+        return columns + (side_levels(bid_prices, bid_sizes, True),) if levels else columns
+
+    columns = (tickers, mid, ask_lqtt)
+    return columns + (side_levels(ask_prices, ask_sizes, False),) if levels else columns
+
+
+def depth_rows (books, side) : 
+    '''
+    Same as depth_columns, as one tuple per book. 
+    '''
+
+    tickers, *columns = depth_columns(books, side)
+
+    return list(zip(tickers, *[column.tolist() for column in columns]))
+
+
+def base_frame (tickers, bid_price_krw, ask_price_krw, base_lqtt, curr_ex_rate, bids=None) : 
+    '''
+    Builds the dataframe of a base exchange in one go from its columns, with fixed dtypes, instead of appending a row per ticker. 
+
+    bids are the level arrays of the books in KRW (see side_levels), kept in USD as the 'bids' column for walk_books. 
+    '''
+
+    bid_price_krw = np.asarray(bid_price_krw, dtype='float64')
+    ask_price_krw = np.asarray(ask_price_krw, dtype='float64')
+    base_lqtt = np.asarray(base_lqtt, dtype='float64')
+
+    df = pd.DataFrame({
+        'base_ticker' : pd.Series(tickers, dtype='object'), 
+        'bid_price_krw' : bid_price_krw, 
+        'ask_price_krw' : ask_price_krw, 
+        'base_lqtt' : base_lqtt, 
+        'price_usd' : bid_price_krw / curr_ex_rate, 
+        'ask_price_usd' : ask_price_krw / curr_ex_rate, 
+        'base_lqtt_usd' : base_lqtt / curr_ex_rate
+    })
+
+    if bids is not None : 
+        df['bids'] = pd.Series([levels * [1 / curr_ex_rate, 1] for levels in bids], dtype='object')
+
+    return df
+
+
+def against_frame (tickers, price_usd, against_lqtt, asks=None) : 
+    '''
+    Builds the dataframe of an exchange compared against in one go from its columns, with fixed dtypes. 
+
+    asks are the level arrays of the books (see side_levels), kept as the 'asks' column for walk_books. 
+    '''
+
+    df = pd.DataFrame({
+        'base_ticker' : pd.Series(tickers, dtype='object'), 
+        'price_usd' : np.asarray(price_usd, dtype='float64'), 
+        'against_lqtt' : np.asarray(against_lqtt, dtype='float64')
+    })
+
+    if asks is not None : 
+        df['asks'] = pd.Series(asks, dtype='object')
+
+    return df
+
+
+# how each venue writes the symbol of an asset, as (prefix, suffix) around the asset. Only KRW and USDT markets are compared. 
+SYMBOL_FORMATS = {
+    'upbit' : ('KRW-', ''), 
+    'bithumb' : ('', ''), 
+    'binance' : ('', 'USDT'), 
+    'bybit' : ('', 'USDT'), 
+    'bitget' : ('', 'USDT'), 
+    'mexc' : ('', 'USDT')
+}
+
+# assets left out per venue 
+SYMBOL_EXCLUSIONS = {
+    # tokens that are diff between upbit and the rest of the market 
+    'upbit' : ['TON'], 
+    # some of the tokens have been delisted but is still in the API showing wrong prices, 
+    # previous empty orderbooks 
+    # 'BCC', 'VEN', 'PAX', 'BCHABC', 'BCHSV', 'BTT', 'USDS', 'NANO', 'MITH', 'USDSB', 'GTO', 'ERD', 'NPXS', 'COCOS', 'MFT', 'STORM', 'BEAM', 'HC', 'MCO', 'BULL', 'BEAR', 'ETHBULL']
+    'binance' : ['BTG'], 
+    # some of the tokens give the wrong prices on MEXC
+    'mexc' : ['GMT', 'GAS', 'META', 'TITAN', 'ALT']
+}
+
+# venue asset name to the asset name used everywhere else, for assets a venue lists under another name, e.g. 'bybit' : {'LUNA2' : 'LUNA'} 
+SYMBOL_ALIASES = {}
+
+
+def base_asset (exchange, symbol) : 
+    '''
+    Returns the asset of a venue symbol, e.g. 'KRW-BTC' on upbit or 'BTCUSDT' on binance -> 'BTC'. 
+
+    None for symbols of other markets (exact prefix / suffix match, so a symbol only containing USDT isn't taken as a USDT market) and for excluded assets. 
+    '''
+
+    prefix, suffix = SYMBOL_FORMATS[exchange]
+
+    if not symbol.startswith(prefix) or not symbol.endswith(suffix) or len(symbol) <= len(prefix) + len(suffix) : 
+        return None
+
+    asset = symbol[len(prefix):len(symbol) - len(suffix)]
+    asset = SYMBOL_ALIASES.get(exchange, {}).get(asset, asset)
+
+    if asset in SYMBOL_EXCLUSIONS.get(exchange, []) : 
+        return None
+
+    return asset
+
+
+def venue_symbol (exchange, asset) : 
+    '''
+    Inverse of base_asset, e.g. 'BTC' -> 'KRW-BTC' on upbit or 'BTCUSDT' on binance. 
+    '''
+
+    prefix, suffix = SYMBOL_FORMATS[exchange]
+    names = {alias : name for name, alias in SYMBOL_ALIASES.get(exchange, {}).items()}
+
+    return prefix + names.get(asset, asset) + suffix
+
+
+def parse_orderbook_upbit (book) : 
+    '''
+    Accepts a single orderbook object returned by the Upbit orderbook endpoint, returns ticker, bids and asks as [price, size] levels for depth_kernel 
+    '''
+
+    orderbook = book['orderbook_units']
+
+    bids = [(order['bid_price'], order['bid_size']) for order in orderbook]
+    asks = [(order['ask_price'], order['ask_size']) for order in orderbook]
+
+    return book['market'], bids, asks
+
+
+def upbit_request_error (json_object, ticker) : 
+    '''
+    Reports a failed Upbit orderbook request, if too many requests were made at the same time returns error - {'name': 'too_many_requests'}
+
+    Rate limit errors are already backed off and retried by the rate limiter, so they are only logged. 
+    '''
+
+    if isinstance(json_object, dict) and json_object.get('name') == 'too_many_requests' : 
+        print (ticker + '- too_many_request ERROR!')
+    else : 
+        print ('SOME OTHER ERROR')
+        tg_notif('SOME OTHER ERROR', 'testing')
+
+
+def parse_orderbook_upbit_batch (ticker_list, json_object) : 
+    '''
+    Accepts the list of tickers requested and the response of the orderbook endpoint, returns the levels of every ticker. 
+    '''
+
+    try : 
+        return [parse_orderbook_upbit(book) for book in json_object]
+
+    except : 
+        upbit_request_error(json_object, ','.join(ticker_list))
+        return []
+
+
+def call_orderbook_upbit (ticker) : 
+    '''
+    Accepts ticker, returns current price and liquidity  
+    '''
+
+    url = "https://api.upbit.com/v1/orderbook"
+
+    parameters = {
+        'markets' : ticker
+    }
+
+    json_object = call_api(url, **parameters)
+
+    # check done here, if too many requests were made at the same time returns error - {'name': 'too_many_requests'}
+    try : 
+        return depth_rows([parse_orderbook_upbit(json_object[0])], 'bids')[0]
+        
+    except : 
+        upbit_request_error(json_object, ticker)
+
+
+def call_orderbook_upbit_batch (ticker_list) : 
+    '''
+    Accepts a list of tickers, returns current price and liquidity of every ticker from a single API call. 
+
+    The orderbook endpoint takes a comma separated list of markets and returns one orderbook object per market. 
+    '''
+
+    url = "https://api.upbit.com/v1/orderbook"
+
+    parameters = {
+        'markets' : ','.join(ticker_list)
+    }
+
+    json_object = call_api(url, **parameters)
+
+    return depth_rows(parse_orderbook_upbit_batch(ticker_list, json_object), 'bids')
+
+
+def get_tickers_upbit () : 
+
+    url = 'https://api.upbit.com/v1/market/all'
+    parameters = {'isDetails': 'false'}
+    
+    json_object = call_api(url, **parameters)
+
+    ticker_list = []
+
+    for i in json_object : 
+        # take only prices for the ones which compares to KRW 
+        if base_asset('upbit', i['market']) : 
+            ticker_list.append (i['market']) 
+
+    return ticker_list
+
+
+def orderbook_jobs_upbit (ticker_list) : 
+    '''
+    The orderbook endpoint accepts multiple markets, so the KRW markets are requested in chunks instead of one request per ticker. 
+    '''
+
+    batch_size = 100
+
+    jobs = []
+
+    for i in range(0, len(ticker_list), batch_size) : 
+        batch = ticker_list[i:i + batch_size]
+        jobs.append(orderbook_job('upbit', "https://api.upbit.com/v1/orderbook", batch, parse_orderbook_upbit_batch, markets=','.join(batch)))
+
+    return jobs
+
+
+def build_df_upbit (batch_outputs, curr_ex_rate=None) : 
+    ''' 
+    All df_base has output of Dataframe with : 
+    columns = ['base_ticker', 'price_usd', 'ask_price_usd', 'lqtt_usd', 'bids']
+    datatype of 'price_usd', 'ask_price_usd' and 'lqtt' - float, 'bids' - level arrays in USD for walk_books 
+    '''
+
+    # the 2% depth of every book of the run is computed in one kernel call 
+    tickers, bid_price_krw, ask_price_krw, base_lqtt, bids = depth_columns(batch_outputs, 'bids', levels=True)
+
+    tickers = [base_asset('upbit', ticker) for ticker in tickers]
+
+    if curr_ex_rate is None : 
+        curr_ex_rate = get_exchange_rate()
+
+    df = base_frame(tickers, bid_price_krw, ask_price_krw, base_lqtt, curr_ex_rate, bids)
+
+    return df
+
+
+def get_prices_upbit() :     
+
+    outputs = fetch_orderbooks(orderbook_jobs_upbit(get_tickers_upbit()))
+
+    return build_df_upbit(outputs)
+    
+
+# bithumb orderbooks are requested from the ALL_KRW endpoint in one request, set to False to request every ticker separately 
+BITHUMB_BULK_ORDERBOOK = True
+
+
+def parse_orderbook_bithumb (ticker, json_object) : 
+
+    data = json_object['data'] 
+
+    bids = [(bid['price'], bid['quantity']) for bid in data['bids']]
+    asks = [(ask['price'], ask['quantity']) for ask in data['asks']]
+
+    return ticker, bids, asks
+
+
+def call_orderbook_bithumb (ticker) : 
+
+    # orderbook here contains all the tickers, don't have to call prices separately.
+    url = "https://api.bithumb.com/public/orderbook/" + ticker + "_KRW"
+
+    json_object = call_api(url)
+
+    return depth_rows([parse_orderbook_bithumb(ticker, json_object)], 'bids')[0]
+
+
+def get_tickers_bithumb () : 
+
+    # get all tickers and their prices
+    url = "https://api.bithumb.com/public/ticker/ALL_KRW"
+
+    json_object = call_api(url) 
+
+    data = json_object['data']
+
+    ticker_list = []
+
+    for ticker, info in data.items() : 
+        if ticker != 'date' and base_asset('bithumb', ticker) : 
+            ticker_list.append(ticker) 
+
+    return ticker_list
+
+
+def orderbook_jobs_bithumb (ticker_list) : 
+    return [orderbook_job('bithumb', "https://api.bithumb.com/public/orderbook/" + ticker + "_KRW", ticker, parse_orderbook_bithumb) for ticker in ticker_list]
+
+
+def parse_orderbook_bithumb_all (ticker_list, json_object) : 
+    '''
+    Accepts the response of the ALL_KRW orderbook endpoint, returns the levels of every ticker in it from one pass over the response. 
+
+    ticker_list limits the output to those tickers, None returns every ticker. 
+    '''
+
+    data = json_object['data']
+
+    outputs = []
+
+    for ticker, book in data.items() : 
+        # the response also carries the timestamp and the payment currency next to the orderbooks 
+        if not isinstance(book, dict) : 
+            continue 
+        if ticker_list is not None and ticker not in ticker_list : 
+            continue 
+        # tickers with an empty side can't be priced 
+        if not book['bids'] or not book['asks'] : 
+            continue 
+
+        outputs.append(parse_orderbook_bithumb(ticker, {'data' : book}))
+
+    return outputs
+
+
+def orderbook_jobs_bithumb_bulk (ticker_list=None) : 
+    '''
+    The orderbook endpoint also serves every KRW market at once, so a single request replaces one request per ticker. 
+
+    The ALL_KRW orderbook only returns up to 5 levels per side, the 2% depth liquidity can come out lower than from the per ticker orderbook for tokens with deep books, 
+    and walk_books would stop at the fifth bid. collect_prices requests the screened tickers again with deepen_bithumb. 
+    '''
+
+    return [orderbook_job('bithumb', "https://api.bithumb.com/public/orderbook/ALL_KRW", ticker_list, parse_orderbook_bithumb_all, count='5')]
+
+
+async def deepen_bithumb (df_bithumb, assets, curr_ex_rate) : 
+    '''
+    Replaces the rows of assets in a dataframe built from the ALL_KRW orderbook with the per ticker orderbooks (30 levels per side), 
+    deep enough for walk_books. Only worth it for the few tickers that passed screening. 
+    '''
+
+    tickers = sorted(set(assets) & set(df_bithumb['base_ticker']))
+
+    if not tickers : 
+        return df_bithumb
+
+    outputs = await fetch_orderbooks_async(orderbook_jobs_bithumb(tickers))
+    df_deep = build_df_bithumb(outputs, curr_ex_rate)
+
+    # tickers whose request failed keep their ALL_KRW row 
+    return pd.concat([df_bithumb[~df_bithumb['base_ticker'].isin(df_deep['base_ticker'])], df_deep], ignore_index=True)
+
+
+def build_df_bithumb (outputs, curr_ex_rate=None) : 
+
+    # the 2% depth of every book of the run is computed in one kernel call, books without entries are already left out 
+    tickers, bid_price_krw, ask_price_krw, base_lqtt, bids = depth_columns(outputs, 'bids', levels=True)
+
+    if curr_ex_rate is None : 
+        curr_ex_rate = get_exchange_rate()
+
+    return base_frame(tickers, bid_price_krw, ask_price_krw, base_lqtt, curr_ex_rate, bids)
+
+
+def get_prices_bithumb(bulk=BITHUMB_BULK_ORDERBOOK) : 
+
+    if bulk : 
+        outputs = fetch_orderbooks(orderbook_jobs_bithumb_bulk())
+    else : 
+        outputs = fetch_orderbooks(orderbook_jobs_bithumb(get_tickers_bithumb()))
+
+    return build_df_bithumb(outputs)
+    
+
+def parse_orderbook_binance (ticker, json_object) : 
+
+    data = json_object
+
+    # sometimes query just fails, or empty orderbook indicate they don't exist as spot anymore
+    if not 'bids' in data or not data['bids']: 
+        return None
+
+    return ticker, data['bids'], data['asks']
+
+
+def call_orderbook_binance(ticker) : 
+    # orderbook here contains all the tickers, don't have to call prices separately.
+    url = "https://api.binance.com/api/v3/depth"
+
+    # weight 5 up to 100 levels, deeper books cost nothing more and walk_books can go further 
+    parameters = {
+        'symbol' : ticker, 
+        'limit' : '100'
+    }
+    
+    json_object = call_api(url, **parameters)
+
+    rows = depth_rows([parse_orderbook_binance(ticker, json_object)], 'asks')
+
+    return rows[0] if rows else None
+
+
+def get_tickers_binance () : 
+
+    url = "https://api.binance.com/api/v3/ticker/price"
+
+    json_object = call_api(url)
+
+    # symbol to last price, the prices are used to screen tickers before their orderbooks are requested 
+    ticker_list = {}
+
+    # returns only the base pair for USDT pairs, exclusions are in SYMBOL_EXCLUSIONS 
+    for ticker in json_object : 
+        if base_asset('binance', ticker['symbol']) : 
+            ticker_list[ticker['symbol']] = float(ticker['price'])
+
+    return ticker_list
+
+
+def orderbook_jobs_binance (ticker_list) : 
+    return [orderbook_job('binance', "https://api.binance.com/api/v3/depth", base_asset('binance', ticker), parse_orderbook_binance, weight=5, symbol=ticker, limit='100') for ticker in ticker_list]
+
+
+def build_df_against (outputs) : 
+    ''' 
+    All df_against has output of Dataframe with : 
+    columns = ['base_ticker', 'price_usd', 'against_lqtt', 'asks']
+    datatype of 'price_usd' - float, 'asks' - level arrays for walk_books 
+    '''
+
+    # the 2% depth of every book of the run is computed in one kernel call, books without entries are already left out 
+    # the orderbook jobs are labelled with the asset instead of the venue symbol 
+    tickers, price_usd, against_lqtt, asks = depth_columns(outputs, 'asks', levels=True)
+
+    return against_frame(tickers, price_usd, against_lqtt, asks)
+
+
+def get_prices_binance() : 
+
+    outputs = fetch_orderbooks(orderbook_jobs_binance(get_tickers_binance()))
+
+    return build_df_against(outputs)
+
+
+def parse_orderbook_bybit (ticker, json_object) : 
+
+    data = json_object['result']
+
+    if not data : 
+        return None
+
+    # both sides come in one list, the kernel takes the best price of each side so the order doesn't matter 
+    bids = [(order['price'], order['size']) for order in data if order['side'] == 'Buy']
+    asks = [(order['price'], order['size']) for order in data if order['side'] == 'Sell']
+
+    return ticker, bids, asks
+
+
+def call_orderbook_bybit(ticker) :     
+    # this url in their documentation gives false info, like DOGEUSDT. The one below is more complete, but does not encompass every single token that is traded too. 
+    # url = "https://api-testnet.bybit.com/v5/market/orderbook"
+
+    url = "https://api.bybit.com/v2/public/orderBook/L2"
+
+    parameters = {
+        'symbol' : ticker
+    }
+
+    json_object = call_api(url, **parameters)
+
+    rows = depth_rows([parse_orderbook_bybit(ticker, json_object)], 'asks')
+
+    return rows[0] if rows else None
+
+
+def get_tickers_bybit () : 
+    url = "https://api.bybit.com/v5/market/tickers?category=spot"
+    
+    json_object = call_api(url) 
+
+    data = json_object['result']['list']
+
+    # symbol to top of book mid price, the prices are used to screen tickers before their orderbooks are requested 
+    ticker_list = {}
+
+    # returns only the base pair for USDT pairs 
+    for ticker in data : 
+        if base_asset('bybit', ticker['symbol']) : 
+            if ticker.get('bid1Price') and ticker.get('ask1Price') : 
+                ticker_list[ticker['symbol']] = (float(ticker['bid1Price']) + float(ticker['ask1Price'])) / 2
+            else : 
+                ticker_list[ticker['symbol']] = float(ticker['lastPrice'] or 0)
+
+    return ticker_list
+
+
+def orderbook_jobs_bybit (ticker_list) : 
+    return [orderbook_job('bybit', "https://api.bybit.com/v2/public/orderBook/L2", base_asset('bybit', ticker), parse_orderbook_bybit, symbol=ticker) for ticker in ticker_list]
+
+
+def get_prices_bybit () : 
+
+    outputs = fetch_orderbooks(orderbook_jobs_bybit(get_tickers_bybit()))
+
+    return build_df_against(outputs)
+
+
+def parse_orderbook_bitget (ticker, json_object) : 
+
+    data = json_object['data']
+    
+    # dealing with empty data
+    if not data['asks']: 
+        return None
+
+    return ticker, data['bids'], data['asks']
+
+
+def call_orderbook_bitget (ticker) : 
+    # orderbook here contains all the tickers, don't have to call prices separately.
+    url = "https://api.bitget.com/api/v2/spot/market/orderbook"
+
+    parameters = {
+        'symbol' : ticker, 
+        'limit' : '150'
+    }
+
+    json_object = call_api(url, **parameters)
+
+    rows = depth_rows([parse_orderbook_bitget(ticker, json_object)], 'asks')
+
+    return rows[0] if rows else None
+
+
+def get_tickers_bitget () : 
+    url = 'https://api.bitget.com/api/spot/v1/market/tickers'
+
+    json_object = call_api(url) 
+
+    data = json_object['data']
+
+    # symbol to top of book mid price, the prices are used to screen tickers before their orderbooks are requested 
+    ticker_list = {}
+
+    for ticker in data : 
+        # some tickers does not have a price 
+        if ticker['buyOne'] != '0':
+            if base_asset('bitget', ticker['symbol']) : 
+                ticker_list[ticker['symbol']] = (float(ticker['buyOne']) + float(ticker['sellOne'])) / 2
+
+    return ticker_list
+
+
+def orderbook_jobs_bitget (ticker_list) : 
+    return [orderbook_job('bitget', "https://api.bitget.com/api/v2/spot/market/orderbook", base_asset('bitget', ticker), parse_orderbook_bitget, symbol=ticker, limit='150') for ticker in ticker_list]
+
+
+def get_prices_bitget () : 
+
+    outputs = fetch_orderbooks(orderbook_jobs_bitget(get_tickers_bitget()))
+
+    return build_df_against(outputs)
+
+
+def parse_orderbook_mexc (ticker, json_object) : 
+
+    data = json_object
+
+    print(ticker)
+    print(data) 
+
+    if not data['bids'] : 
+        return None
+    
+    return ticker, data['bids'], data['asks']
+
+
+def call_orderbook_mexc (ticker) : 
+    # orderbook here contains all the tickers, don't have to call prices separately.
+    url = 'https://api.mexc.com/api/v3/depth'
+
+    parameters = {
+        'symbol' : ticker, 
+    }
+
+    json_object = call_api(url, **parameters)
+
+    rows = depth_rows([parse_orderbook_mexc(ticker, json_object)], 'asks')
+
+    return rows[0] if rows else None
+
+
+def get_tickers_mexc () : 
+    url = 'https://api.mexc.com/api/v3/ticker/price'
+
+    json_object = call_api(url)
+
+    # symbol to last price, the prices are used to screen tickers before their orderbooks are requested 
+    ticker_list = {}
+
+    print(json_object)
+
+    # returns only the base pair for USDT pairs, exclusions are in SYMBOL_EXCLUSIONS 
+    for ticker in json_object : 
+        if base_asset('mexc', ticker['symbol']) : 
+            ticker_list[ticker['symbol']] = float(ticker['price'])
+
+    return ticker_list
+
+
+def orderbook_jobs_mexc (ticker_list) : 
+    return [orderbook_job('mexc', 'https://api.mexc.com/api/v3/depth', base_asset('mexc', ticker), parse_orderbook_mexc, symbol=ticker) for ticker in ticker_list]
+
+
+def get_prices_mexc () : 
+
+    outputs = fetch_orderbooks(orderbook_jobs_mexc(get_tickers_mexc()))
+
+    return build_df_against(outputs)
+
+
+# stages of each exchange's collector : ticker list, orderbook jobs, and the dataframe built from the orderbook outputs. 
+# None as the ticker list stage means the orderbook request doesn't need one. 
+COLLECTORS = {
+    'upbit' : (get_tickers_upbit, orderbook_jobs_upbit, build_df_upbit), 
+    'bithumb' : (None, orderbook_jobs_bithumb_bulk, build_df_bithumb) if BITHUMB_BULK_ORDERBOOK else (get_tickers_bithumb, orderbook_jobs_bithumb, build_df_bithumb), 
+    'binance' : (get_tickers_binance, orderbook_jobs_binance, build_df_against), 
+    'bybit' : (get_tickers_bybit, orderbook_jobs_bybit, build_df_against), 
+    'bitget' : (get_tickers_bitget, orderbook_jobs_bitget, build_df_against), 
+    'mexc' : (get_tickers_mexc, orderbook_jobs_mexc, build_df_against)
+}
+
+
+# korean exchanges, their orderbooks are always collected in full. The rest are the exchanges compared against. 
+BASE_EXCHANGES = ['upbit', 'bithumb']
+
+# the bulk ticker prices are last / top of book prices, not the orderbook mid used in check_price_diff, so screening lets through tickers this close to the trigger 
+SCREEN_MARGIN_PCT = 2
+
+
+def screen_tickers (exchange, ticker_list, base_frames, profit_pct_trig) : 
+    '''
+    Accepts the symbol to price dictionary of an exchange compared against, and the dataframes of the base exchanges. 
+
+    Returns only the symbols whose top of book premium on any base exchange could pass profit_pct_trig in check_price_diff, plus ETH which check_price_diff needs for the exit discount. 
+    Uses the same formula as check_price_diff, with the bulk ticker prices in place of the orderbook prices. 
+    '''
+
+    df_screen = pd.DataFrame({'symbol' : list(ticker_list.keys()), 'price_usd_against' : list(ticker_list.values())})
+    df_screen = df_screen[df_screen['price_usd_against'] > 0]
+    df_screen['base_ticker'] = [base_asset(exchange, symbol) for symbol in df_screen['symbol']]
+
+    candidates = set(df_screen.loc[df_screen['base_ticker'] == 'ETH', 'symbol'])
+
+    for df_base in base_frames : 
+        df_combined = pd.merge(df_screen, df_base[['base_ticker', 'price_usd', 'ask_price_usd']], on='base_ticker', how='inner')
+
+        df_eth = df_combined[df_combined['base_ticker'] == 'ETH']
+
+        # without ETH on both sides there is no exit discount to apply, which only lets more tickers through 
+        if df_eth.empty : 
+            base_eth_ask_price_pct = 0
+        else : 
+            base_eth_ask_price_pct = abs(df_eth['ask_price_usd'].iloc[0] - df_eth['price_usd_against'].iloc[0]) / df_eth['price_usd_against'].iloc[0]
+
+        profit_pct = profit_pct_estimate(df_combined['price_usd'] / df_combined['price_usd_against'] - 1, base_eth_ask_price_pct)
+
+        candidates.update(df_combined.loc[profit_pct > profit_pct_trig - SCREEN_MARGIN_PCT, 'symbol'])
+
+    return [symbol for symbol in ticker_list if symbol in candidates]
+
+
+async def collect_exchange_async (exchange, ticker_list=None, curr_ex_rate=None) : 
+    '''
+    Runs one exchange's collector. The blocking ticker list call and dataframe build are pushed to worker threads so the other exchanges keep fetching in the meantime. 
+
+    ticker_list skips the ticker list stage, used when the tickers were already fetched and screened. 
+    curr_ex_rate is passed to the base exchanges, so every collector of a run shares one exchange rate lookup. 
+    '''
+
+    get_tickers, orderbook_jobs, build_df = COLLECTORS[exchange]
+
+    loop = asyncio.get_running_loop()
+
+    # the symbol universe, only downloaded when nothing is cached 
+    if ticker_list is None and get_tickers : 
+        with METRICS.stage('tickers', exchange=exchange) : 
+            ticker_list = await loop.run_in_executor(None, get_universe, exchange)
+
+    # wall time of the exchange's requests and parsing, the parsing alone is the parse stage 
+    with METRICS.stage('fetch', exchange=exchange) : 
+        outputs = await fetch_orderbooks_async(orderbook_jobs(ticker_list))
+
+    with METRICS.stage('build_df', exchange=exchange) : 
+        if exchange in BASE_EXCHANGES : 
+            return await loop.run_in_executor(None, build_df, outputs, curr_ex_rate)
+
+        return await loop.run_in_executor(None, build_df, outputs)
+
+
+def collect_prices (exchanges, profit_pct_trig=None, curr_ex_rate=None, ticker_prices=None) : 
+    '''
+    Collects the dataframes of all the exchanges in parallel, each exchange within its own ORDERBOOK_CONCURRENCY budget. A run takes about as long as the slowest exchange instead of the sum of all of them. 
+
+    With profit_pct_trig the exchanges compared against are collected in two stages : the base exchanges and the bulk ticker prices first, 
+    then orderbooks only for the tickers that pass screen_tickers. 
+
+    When the run has both base exchanges and exchanges compared against, orderbooks are only requested for the assets of the symbol registry 
+    listed on at least one of each, the rest would be dropped by the merge in check_price_diff anyway. 
+
+    The exchange rate is looked up once for the run when curr_ex_rate isn't given. 
+
+    With profit_pct_trig, a ticker_prices dictionary gets the bulk ticker prices the exchanges compared against were screened on (exchange to symbol to price), 
+    so tickers without an orderbook can still be recorded. 
+
+    Returns a dictionary of exchange name to dataframe. 
+    '''
+
+    if curr_ex_rate is None and any(exchange in BASE_EXCHANGES for exchange in exchanges) : 
+        curr_ex_rate = get_exchange_rate()
+
+    registry = None
+    assets = None
+    run_start = time.time()
+
+    if any(exchange in BASE_EXCHANGES for exchange in exchanges) and any(exchange not in BASE_EXCHANGES for exchange in exchanges) : 
+        registry = get_registry(exchanges)
+        assets = tradable_assets(registry, exchanges)
+
+    def run_symbols (exchange) : 
+        if assets is None : 
+            return None
+        return sorted(registry[asset][exchange] for asset in assets if exchange in registry[asset])
+
+    async def collect_all () : 
+        return await asyncio.gather(*[collect_exchange_async(exchange, run_symbols(exchange), curr_ex_rate) for exchange in exchanges])
+
+    def screening_prices (exchange) : 
+        entry = RUNTIME['universe'].get(exchange)
+
+        # on a cold start the registry just downloaded the same list, it is as fresh as a second download would be 
+        if entry is not None and entry['fetched'] >= run_start : 
+            return entry['ticker_list']
+
+        return COLLECTORS[exchange][0]()
+
+    async def collect_screened () : 
+        loop = asyncio.get_running_loop()
+
+        base_exchanges = [exchange for exchange in exchanges if exchange in BASE_EXCHANGES]
+        against_exchanges = [exchange for exchange in exchanges if exchange not in BASE_EXCHANGES]
+
+        # the bulk ticker prices are the screening input, so these lists are downloaded every run instead of coming from the symbol universe 
+        base_frames, ticker_lists = await asyncio.gather(
+            asyncio.gather(*[collect_exchange_async(exchange, run_symbols(exchange), curr_ex_rate) for exchange in base_exchanges]), 
+            asyncio.gather(*[loop.run_in_executor(None, screening_prices, exchange) for exchange in against_exchanges])
+        )
+
+        screened_lists = []
+
+        for exchange, ticker_list in zip(against_exchanges, ticker_lists) : 
+            with METRICS.stage('screen', exchange=exchange) : 
+                if assets is not None : 
+                    ticker_list = tradable_symbols(exchange, ticker_list, assets)
+                screened_list = screen_tickers(exchange, ticker_list, base_frames, profit_pct_trig)
+
+            print('{} - {} of {} tickers passed screening'.format(exchange, len(screened_list), len(ticker_list)))
+            screened_lists.append(screened_list)
+
+            if ticker_prices is not None : 
+                ticker_prices[exchange] = ticker_list
+
+        base_frames = list(base_frames)
+
+        # the ALL_KRW bithumb books stop at 5 levels, the screened tickers are requested again with deeper books while the orderbooks compared against are fetched 
+        async def deepen () : 
+            if 'bithumb' not in base_exchanges or not BITHUMB_BULK_ORDERBOOK : 
+                return 
+
+            i = base_exchanges.index('bithumb')
+            assets = {base_asset(exchange, symbol) for exchange, screened_list in zip(against_exchanges, screened_lists) for symbol in screened_list}
+
+            with METRICS.stage('deepen', exchange='bithumb') : 
+                base_frames[i] = await deepen_bithumb(base_frames[i], assets, curr_ex_rate)
+
+        against_frames, _ = await asyncio.gather(
+            asyncio.gather(*[collect_exchange_async(exchange, screened_list) for exchange, screened_list in zip(against_exchanges, screened_lists)]), 
+            deepen()
+        )
+
+        return dict(zip(base_exchanges + against_exchanges, base_frames + list(against_frames)))
+
+    if profit_pct_trig is None : 
+        frames = get_event_loop().run_until_complete(collect_all())
+        return dict(zip(exchanges, frames))
+
+    return get_event_loop().run_until_complete(collect_screened())
+
+
+# state reused by warm Lambda invocations (HTTP pools, event loop, Mongo client, exchange rate cache, symbol universe). 
+# invalidation rules : 
+# - everything is rebuilt once the context is older than RUNTIME_MAX_AGE, so long lived containers pick up new listings and fresh connections 
+# - the HTTP pools are closed and rebuilt after a run fails with a connection error 
+# - the exchange rate follows EXCHANGE_RATE_CACHE's hourly expiry 
+# - each exchange's symbol universe is refreshed in the background after SYMBOL_UNIVERSE_TTL, see get_universe 
+RUNTIME_MAX_AGE = 6 * 3600
+SYMBOL_UNIVERSE_TTL = int(os.environ.get('SYMBOL_UNIVERSE_TTL', 15 * 60))
+
+RUNTIME = {'created' : None, 'runs' : 0, 'universe' : {}, 'registry' : None}
+
+
+def close_http_sessions () : 
+    '''
+    Closes every pooled session, the next request opens new ones. 
+    '''
+
+    for session in HTTP_SESSIONS.values() : 
+        session.close()
+    HTTP_SESSIONS.clear()
+
+    if EVENT_LOOP is not None and not EVENT_LOOP.is_closed() : 
+        for session in ASYNC_SESSIONS.values() : 
+            EVENT_LOOP.run_until_complete(session.close())
+    ASYNC_SESSIONS.clear()
+
+
+def reset_runtime () : 
+    close_http_sessions()
+
+    for client in MONGO_CLIENTS.values() : 
+        client.close()
+    MONGO_CLIENTS.clear()
+
+    EXCHANGE_RATE_CACHE['exchange_rate'] = None
+    EXCHANGE_RATE_CACHE['expires'] = None
+
+    RUNTIME['created'] = time.time()
+    RUNTIME['runs'] = 0
+    RUNTIME['universe'] = {}
+    RUNTIME['registry'] = None
+
+
+def get_runtime () : 
+    '''
+    Returns the runtime context of the container, created on the first (cold) invocation and reused by the warm ones until it expires. 
+    '''
+
+    if RUNTIME['created'] is None or time.time() - RUNTIME['created'] > RUNTIME_MAX_AGE : 
+        print('cold start, setting up runtime context')
+        reset_runtime()
+
+    RUNTIME['runs'] += 1
+
+    return RUNTIME
+
+
+# where the symbol universe is kept besides memory : 'memory', 'disk' (a json file, survives restarts of the daemon and is shared by processes on one host) or 'mongo' (shared by every container) 
+UNIVERSE_STORE = os.environ.get('UNIVERSE_STORE', 'memory')
+UNIVERSE_PATH = os.environ.get('UNIVERSE_PATH', '/tmp/symbol_universe.json')
+UNIVERSE_COLLECTION = os.environ.get('UNIVERSE_COLLECTION', 'symbol_universe')
+
+# exchanges with a listing endpoint, bithumb's ticker list is needed by the daemon even when its orderbooks are collected in bulk 
+UNIVERSE_SOURCES = {
+    'upbit' : get_tickers_upbit, 
+    'bithumb' : get_tickers_bithumb, 
+    'binance' : get_tickers_binance, 
+    'bybit' : get_tickers_bybit, 
+    'bitget' : get_tickers_bitget, 
+    'mexc' : get_tickers_mexc
+}
+
+UNIVERSE_LOCK = threading.Lock()
+UNIVERSE_REFRESHING = set()
+
+
+def load_universe (exchange) : 
+    '''
+    Reads the stored symbol universe of an exchange, None when there is none or the store can't be reached. 
+    '''
+
+    try : 
+        if UNIVERSE_STORE == 'disk' and os.path.exists(UNIVERSE_PATH) : 
+            with open(UNIVERSE_PATH) as f : 
+                return json.load(f).get(exchange)
+
+        if UNIVERSE_STORE == 'mongo' : 
+            return get_mongo_db()[UNIVERSE_COLLECTION].find_one({'_id' : exchange}, {'_id' : 0})
+
+    except Exception as e : 
+        print('loading symbol universe of {} failed :'.format(exchange), e)
+
+    return None
+
+
+def save_universe (exchange, entry) : 
+
+    try : 
+        if UNIVERSE_STORE == 'disk' : 
+            with UNIVERSE_LOCK : 
+                stored = {}
+                if os.path.exists(UNIVERSE_PATH) : 
+                    with open(UNIVERSE_PATH) as f : 
+                        stored = json.load(f)
+
+                stored[exchange] = entry
+
+                # written next to the file and renamed, so readers never see half a file 
+                with open(UNIVERSE_PATH + '.tmp', 'w') as f : 
+                    json.dump(stored, f)
+                os.replace(UNIVERSE_PATH + '.tmp', UNIVERSE_PATH)
+
+        elif UNIVERSE_STORE == 'mongo' : 
+            get_mongo_db()[UNIVERSE_COLLECTION].replace_one({'_id' : exchange}, entry, upsert=True)
+
+    except Exception as e : 
+        print('saving symbol universe of {} failed :'.format(exchange), e)
+
+
+def universe_diff (old_list, new_list) : 
+    '''
+    Returns the symbols listed and delisted between two ticker lists, works for lists and for symbol to price dictionaries. 
+    '''
+
+    old_symbols = set(old_list)
+    new_symbols = set(new_list)
+
+    return sorted(new_symbols - old_symbols), sorted(old_symbols - new_symbols)
+
+
+def refresh_universe (exchange) : 
+    '''
+    Downloads the ticker list of an exchange and stores it, printing the listings and delistings since the previous list. 
+    '''
+
+    ticker_list = UNIVERSE_SOURCES[exchange]()
+    previous = RUNTIME['universe'].get(exchange)
+
+    entry = {'fetched' : time.time(), 'ticker_list' : ticker_list}
+
+    if previous is not None : 
+        listed, delisted = universe_diff(previous['ticker_list'], ticker_list)
+
+        if listed or delisted : 
+            print('{} - listed : {}, delisted : {}'.format(exchange, listed, delisted))
+
+        entry['listed'] = listed
+        entry['delisted'] = delisted
+
+    RUNTIME['universe'][exchange] = entry
+    save_universe(exchange, entry)
+
+    return entry
+
+
+def refresh_universe_background (exchange) : 
+    '''
+    Refreshes the universe of an exchange in a worker thread, at most one refresh per exchange at a time. 
+    '''
+
+    with UNIVERSE_LOCK : 
+        if exchange in UNIVERSE_REFRESHING : 
+            return 
+        UNIVERSE_REFRESHING.add(exchange)
+
+    def refresh () : 
+        try : 
+            refresh_universe(exchange)
+        except Exception as e : 
+            print('refreshing symbol universe of {} failed :'.format(exchange), e)
+        finally : 
+            with UNIVERSE_LOCK : 
+                UNIVERSE_REFRESHING.discard(exchange)
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+
+def get_universe (exchange) : 
+    '''
+    Ticker list of an exchange from the symbol universe, same format as its get_tickers function. 
+
+    Memory first, then UNIVERSE_STORE, and only downloaded in the run when neither has it. 
+    Once older than SYMBOL_UNIVERSE_TTL the cached list is still returned and a new one is downloaded in the background, so listings and delistings show up a run later. 
+    The prices in the lists of the exchanges compared against are as old as the list, only use them for the symbols. 
+    '''
+
+    entry = RUNTIME['universe'].get(exchange)
+
+    if entry is None : 
+        entry = load_universe(exchange)
+
+        if entry is None : 
+            return refresh_universe(exchange)['ticker_list']
+
+        RUNTIME['universe'][exchange] = entry
+
+    if time.time() - entry['fetched'] > SYMBOL_UNIVERSE_TTL : 
+        refresh_universe_background(exchange)
+
+    return entry['ticker_list']
+
+
+def get_registry (exchanges) : 
+    '''
+    Returns the symbol registry of exchanges : each asset to its exact symbol on every venue listing it, e.g. {'BTC' : {'upbit' : 'KRW-BTC', 'binance' : 'BTCUSDT'}}. 
+
+    Built from the symbol universes with SYMBOL_FORMATS, SYMBOL_ALIASES and SYMBOL_EXCLUSIONS applied, and only rebuilt when one of the universes was refreshed. 
+    '''
+
+    ticker_lists = {exchange : get_universe(exchange) for exchange in exchanges}
+    key = tuple((exchange, RUNTIME['universe'][exchange]['fetched']) for exchange in exchanges)
+
+    if RUNTIME['registry'] is not None and RUNTIME['registry']['key'] == key : 
+        return RUNTIME['registry']['registry']
+
+    registry = {}
+
+    for exchange, ticker_list in ticker_lists.items() : 
+        for symbol in ticker_list : 
+            asset = base_asset(exchange, symbol)
+            if asset : 
+                registry.setdefault(asset, {})[exchange] = symbol
+
+    RUNTIME['registry'] = {'key' : key, 'registry' : registry}
+
+    return registry
+
+
+def tradable_assets (registry, exchanges) : 
+    '''
+    Assets listed on at least one base exchange and at least one exchange compared against among exchanges. 
+    '''
+
+    base_exchanges = [exchange for exchange in exchanges if exchange in BASE_EXCHANGES]
+    against_exchanges = [exchange for exchange in exchanges if exchange not in BASE_EXCHANGES]
+
+    return {
+        asset for asset, venues in registry.items() 
+        if any(exchange in venues for exchange in base_exchanges) and any(exchange in venues for exchange in against_exchanges)
+    }
+
+
+def tradable_symbols (exchange, ticker_list, assets) : 
+    '''
+    Keeps the symbols of ticker_list whose asset is in assets, symbol to price dictionaries stay dictionaries. 
+    '''
+
+    if isinstance(ticker_list, dict) : 
+        return {symbol : price for symbol, price in ticker_list.items() if base_asset(exchange, symbol) in assets}
+
+    return [symbol for symbol in ticker_list if base_asset(exchange, symbol) in assets]
+
+
+def run_warm (destination) : 
+    '''
+    Entry point for the Lambda handler, runs execute inside the container's runtime context. 
+    '''
+
+    runtime = get_runtime()
+
+    try : 
+        execute(destination)
+
+    # pooled connections may have been dropped while the container was frozen 
+    except (aiohttp.ClientError, requests.exceptions.ConnectionError) : 
+        close_http_sessions()
+        raise
+
+    # the container is frozen once the handler returns, queued alerts and the metrics have to be out by then 
+    finally : 
+        with METRICS.stage('alert_flush') : 
+            TELEGRAM.flush()
+
+        # the recorded runs are kept in memory for the next invocations, written once a batch is full or at exit 
+        RECORDER.flush(write=False)
+
+        METRICS.emit_emf()
+
+    print('runtime context : run {} of this container'.format(runtime['runs']))
+
+
+# names used in the telegram messages 
+EXCHANGE_NAMES = {
+    'upbit' : 'Upbit', 
+    'bithumb' : 'Bithumb', 
+    'binance' : 'Binance', 
+    'bybit' : 'Bybit', 
+    'bitget' : 'Bitget', 
+    'mexc' : 'MEXC'
+}
+
+
+def profit_pct_estimate (pct_diff, base_eth_ask_price_pct) : 
+    '''
+    Formula explanation : We are buying token from other exchanges, selling on upbit for KRW, sell KRW for ETH, and send back. 
+    So the premium of the token is discounted by the premium of ETH at its ask price on the base exchange. 
+
+    Works on single values and on whole columns. 
+    '''
+
+    return 100 * (pct_diff + 1) * (1 - base_eth_ask_price_pct) - 100
+
+
+# alert state is kept in memory and mirrored to mongo (ALERT_STORE = 'mongo'), so every Lambda container sees the alerts the others sent. 'memory' keeps it in the process only 
+ALERT_STORE = os.environ.get('ALERT_STORE', 'mongo')
+ALERT_COLLECTION = os.environ.get('ALERT_COLLECTION', 'alert_state')
+
+# a ticker / base / against pair that keeps triggering alerts again after ALERT_COOLDOWN seconds, or earlier once its profit_pct moved ALERT_STEP_PCT from the last alert 
+ALERT_COOLDOWN = 30 * 60
+ALERT_STEP_PCT = 1
+
+# hysteresis, a pair only counts as a new opportunity again after its profit_pct fell ALERT_RESET_PCT below profit_pct_trig 
+ALERT_RESET_PCT = 1
+
+# the "No tickers with absolute profit" message is sent at most this often 
+HEARTBEAT_INTERVAL = 60 * 60
+
+
+class AlertState : 
+    '''
+    Last alert of every (ticker, base venue, against venue) pair, and of the heartbeat of each destination. 
+
+    observe decides which triggered pairs are sent : a pair alerts when it starts triggering, when its profit_pct moved ALERT_STEP_PCT since its last alert, 
+    or when it is still triggering after ALERT_COOLDOWN. A pair is released once its profit_pct drops ALERT_RESET_PCT below the trigger, so a premium 
+    hovering around the trigger doesn't alert on every crossing. 
+    '''
+
+    def __init__ (self) : 
+        self.states = {}
+        # check_price_diff runs in worker threads in the daemon 
+        self.lock = threading.Lock()
+
+    def collection (self) : 
+        return get_mongo_db()[ALERT_COLLECTION]
+
+    def load (self) : 
+        '''
+        Replaces the in-memory mirror with the stored state. Called at the start of every run, other containers may have alerted since. 
+        '''
+
+        if ALERT_STORE != 'mongo' : 
+            return 
+
+        try : 
+            states = {state['_id'] : state for state in self.collection().find()}
+        except Exception as e : 
+            print('loading alert state failed, using the in-memory state :', e)
+            return 
+
+        with self.lock : 
+            self.states = states
+
+    def save (self, states) : 
+        if ALERT_STORE != 'mongo' or not states : 
+            return 
+
+        try : 
+            self.collection().bulk_write([pymongo.ReplaceOne({'_id' : state['_id']}, state, upsert=True) for state in states])
+        except Exception as e : 
+            print('saving alert state failed :', e)
+
+    def observe (self, tickers, bases, againsts, profit_pcts, triggers, profit_pct_trig) : 
+        '''
+        Accepts the columns of a checked table, one row per pair. Returns a boolean array of the rows to send, and records them as sent. 
+        '''
+
+        now = time.time()
+        alert = np.zeros(len(tickers), dtype=bool)
+        changed = []
+
+        with self.lock : 
+            for i, (ticker, base, against, profit_pct, trigger) in enumerate(zip(tickers, bases, againsts, profit_pcts, triggers)) : 
+                key = '{}:{}:{}'.format(ticker, base.lower(), against.lower())
+                state = self.states.get(key)
+
+                if trigger : 
+                    if state is None or not state['active'] or abs(profit_pct - state['profit_pct']) >= ALERT_STEP_PCT or now - state['last_alert'] >= ALERT_COOLDOWN : 
+                        alert[i] = True
+                        state = {'_id' : key, 'active' : True, 'profit_pct' : float(profit_pct), 'last_alert' : now}
+                        self.states[key] = state
+                        changed.append(state)
+
+                # nan profit_pct (base price lower) also releases the pair 
+                elif state is not None and state['active'] and not profit_pct >= profit_pct_trig - ALERT_RESET_PCT : 
+                    state['active'] = False
+                    changed.append(state)
+
+        self.save(changed)
+
+        return alert
+
+    def heartbeat_due (self, destination) : 
+        '''
+        True at most once per HEARTBEAT_INTERVAL per destination, and records it as sent. 
+        '''
+
+        now = time.time()
+        key = 'heartbeat:' + destination
+
+        with self.lock : 
+            state = self.states.get(key)
+
+            if state is not None and now - state['last_alert'] < HEARTBEAT_INTERVAL : 
+                return False
+
+            state = {'_id' : key, 'last_alert' : now}
+            self.states[key] = state
+
+        self.save([state])
+
+        return True
+
+
+ALERT_STATE = AlertState()
+
+
+def alert_message (row, base_name, against_name) : 
+    '''
+    Telegram message of one alerted row of check_price_diff or check_venue_table, both have base_ticker, pct_diff, profit_pct, abs_profit, size_usd and base_lqtt_usd. 
+    '''
+
+    message1 = '{} - {} is higher than {} by {:.2f} %.'.format(row.base_ticker, base_name, against_name, abs(row.pct_diff) * 100)
+    message2 = 'Absolute Profit - $ {:,.0f}'.format(row.abs_profit)
+
+    message3 = 'Profit Pct Estimate - {:.2f} %'.format(row.profit_pct)
+    message4 = '{} 2% Depth Liquidity - $ {:,.0f}'.format(base_name, row.base_lqtt_usd)
+
+    # what the abs_profit is made on, after walking both books 
+    if row.size_usd > 0 : 
+        message4 += '\nBest Size - $ {:,.0f} at {:.2f} %'.format(row.size_usd, row.abs_profit / row.size_usd * 100)
+
+    return message1 + '\n\n' + message2 + '\n\n' + message3 + '\n' + message4
+
+
+def check_price_diff (df_base, df_against, base_name, against_name, profit_pct_trig, abs_profit_trig, lqtt_trig, destination, alert_state=None) : 
+    '''
+    Accepts list of tickers for two exchanges, maps the tickers, and sends notification when triggered. 
+
+    With alert_state only the triggered tickers it lets through are sent, see AlertState. 
+    Returns the merged table with profit_pct, abs_profit, size_usd, trigger and alert for every ticker. df_base and df_against are left unchanged. 
+    '''
+
+    df_combined = pd.merge(
+        df_base.rename(columns={'price_usd' : 'price_usd_base', 'ask_price_usd' : 'ask_price_usd_base'}), 
+        df_against.rename(columns={'price_usd' : 'price_usd_against'}), 
+        on='base_ticker', how='left'
+    )
+
+    # if positive then base is higher, if negative then base is lower. 
+    df_combined['usd_diff'] = df_combined['price_usd_base'] - df_combined['price_usd_against']
+    df_combined['pct_diff'] = abs(df_combined['usd_diff'] / df_combined['price_usd_against']) 
+
+    # we need ask price of ETH on upbit instead bid price, see profit_pct_estimate 
+    df_combined['ask_usd_diff'] = df_combined['ask_price_usd_base'] - df_combined['price_usd_against']
+    df_combined['ask_pct_diff'] = abs(df_combined['ask_usd_diff'] / df_combined['price_usd_against']) 
+
+    # get ask price pct difference of ETH, without it there is no profit estimate 
+    eth_ask_pct_diff = df_combined.loc[df_combined['base_ticker'] == 'ETH', 'ask_pct_diff']
+    base_eth_ask_price_pct = eth_ask_pct_diff.iloc[0] if len(eth_ask_pct_diff) else np.nan
+
+    # only the case when base price > against price 
+    df_combined['profit_pct'] = profit_pct_estimate(df_combined['pct_diff'], base_eth_ask_price_pct).where(df_combined['usd_diff'] > 0)
+
+    # the profit at the best size walking both books, see walk_books. Dataframes without the levels fall back to profit_pct on the whole 2% depth liquidity 
+    if 'bids' in df_combined and 'asks' in df_combined : 
+        df_combined['size_usd'], df_combined['abs_profit'] = executable_profit(df_combined['profit_pct'], df_combined['bids'].to_numpy(), df_combined['asks'].to_numpy(), base_eth_ask_price_pct)
+    else : 
+        df_combined['size_usd'] = np.nan
+        df_combined['abs_profit'] = df_combined['profit_pct'] / 100 * df_combined['base_lqtt_usd']
+
+    # conditions for notification trigger 
+    df_combined['trigger'] = (
+        (df_combined['profit_pct'] > profit_pct_trig) 
+        & (df_combined['abs_profit'] > abs_profit_trig) 
+        & (df_combined['base_lqtt_usd'] > lqtt_trig) 
+        & (df_combined['against_lqtt'] > lqtt_trig)
+    )
+
+    if alert_state is None : 
+        df_combined['alert'] = df_combined['trigger']
+    else : 
+        n = len(df_combined)
+        df_combined['alert'] = alert_state.observe(df_combined['base_ticker'], [base_name] * n, [against_name] * n, df_combined['profit_pct'], df_combined['trigger'], profit_pct_trig)
+
+    for row in df_combined[df_combined['alert']].itertuples() : 
+        tg_notif(alert_message(row, base_name, against_name), destination) 
+    
+    return df_combined
+    
+
+def build_venue_table (base_frames, against_frames) : 
+    '''
+    Accepts dictionaries of exchange name to dataframe for the base exchanges and the exchanges compared against. 
+
+    Returns one table indexed by base_ticker with a column group per exchange : 
+    (exchange, 'price_usd'), (exchange, 'ask_price_usd'), (exchange, 'base_lqtt_usd') for the base exchanges and (exchange, 'price_usd'), (exchange, 'against_lqtt') for the rest, 
+    plus (exchange, 'bids') and (exchange, 'asks') when the dataframes have the levels. 
+    Tickers missing on an exchange are NaN in its columns. 
+    '''
+
+    parts = {}
+
+    for exchange, df in base_frames.items() : 
+        columns = ['price_usd', 'ask_price_usd', 'base_lqtt_usd'] + (['bids'] if 'bids' in df else [])
+        parts[exchange] = df.drop_duplicates('base_ticker').set_index('base_ticker')[columns]
+
+    for exchange, df in against_frames.items() : 
+        columns = ['price_usd', 'against_lqtt'] + (['asks'] if 'asks' in df else [])
+        parts[exchange] = df.drop_duplicates('base_ticker').set_index('base_ticker')[columns]
+
+    table = pd.concat(parts, axis=1)
+    table.index.name = 'base_ticker'
+
+    return table
+
+
+def check_venue_table (table, base_exchanges, against_exchanges, profit_pct_trig, abs_profit_trig, lqtt_trig, destination, alert_state=None, pairs=None) : 
+    '''
+    Evaluates every base / against exchange pair of the venue table at once, same formula and conditions as check_price_diff. 
+
+    For every ticker the pair with the highest absolute profit among the triggered ones is picked (the highest profit_pct when none triggered), 
+    so a token sends at most one notification however many exchanges trigger for it. 
+    With alert_state every pair is observed and a ticker is sent when any of its pairs is let through, with the best of those, see AlertState. 
+    Returns a dataframe with one row per ticker : best_base, best_against, pct_diff, profit_pct, abs_profit, size_usd, base_lqtt_usd, against_lqtt, trigger, alert. 
+
+    A pairs list gets a dataframe of every pair with a positive profit_pct, the pairs abs_profit was walked for : 
+    base_ticker, base, against, profit_pct, abs_profit, size_usd, base_lqtt_usd, against_lqtt. 
+    '''
+
+    # arrays of shape (tickers, base exchanges) and (tickers, against exchanges) 
+    base_price = np.column_stack([table[(exchange, 'price_usd')].to_numpy(dtype=float) for exchange in base_exchanges])
+    base_ask_price = np.column_stack([table[(exchange, 'ask_price_usd')].to_numpy(dtype=float) for exchange in base_exchanges])
+    base_lqtt = np.column_stack([table[(exchange, 'base_lqtt_usd')].to_numpy(dtype=float) for exchange in base_exchanges])
+    against_price = np.column_stack([table[(exchange, 'price_usd')].to_numpy(dtype=float) for exchange in against_exchanges])
+    against_lqtt = np.column_stack([table[(exchange, 'against_lqtt')].to_numpy(dtype=float) for exchange in against_exchanges])
+
+    with np.errstate(invalid='ignore', divide='ignore') : 
+        # ask price pct difference of ETH for every pair, shape (base exchanges, against exchanges) 
+        if 'ETH' in table.index : 
+            eth = table.index.get_loc('ETH')
+            base_eth_ask_price_pct = abs(base_ask_price[eth][:, None] - against_price[eth][None, :]) / against_price[eth][None, :]
+        else : 
+            base_eth_ask_price_pct = np.full((len(base_exchanges), len(against_exchanges)), np.nan)
+
+        # shape (tickers, base exchanges, against exchanges) 
+        usd_diff = base_price[:, :, None] - against_price[:, None, :]
+        pct_diff = abs(usd_diff / against_price[:, None, :])
+
+        # only the case when base price > against price 
+        profit_pct = np.where(usd_diff > 0, profit_pct_estimate(pct_diff, base_eth_ask_price_pct[None, :, :]), np.nan)
+
+        # the profit at the best size walking both books, every pair of every ticker in one call, see walk_books. 
+        # tables without the levels fall back to profit_pct on the whole 2% depth liquidity 
+        if all((exchange, 'bids') in table for exchange in base_exchanges) and all((exchange, 'asks') in table for exchange in against_exchanges) : 
+            bids = np.column_stack([table[(exchange, 'bids')].to_numpy() for exchange in base_exchanges])
+            asks = np.column_stack([table[(exchange, 'asks')].to_numpy() for exchange in against_exchanges])
+
+            size_usd, abs_profit = executable_profit(
+                profit_pct.reshape(-1), 
+                np.broadcast_to(bids[:, :, None], profit_pct.shape).reshape(-1), 
+                np.broadcast_to(asks[:, None, :], profit_pct.shape).reshape(-1), 
+                np.broadcast_to(base_eth_ask_price_pct[None, :, :], profit_pct.shape).reshape(-1)
+            )
+            size_usd = size_usd.reshape(profit_pct.shape)
+            abs_profit = abs_profit.reshape(profit_pct.shape)
+        else : 
+            size_usd = np.full(profit_pct.shape, np.nan)
+            abs_profit = profit_pct / 100 * base_lqtt[:, :, None]
+
+        trigger = (profit_pct > profit_pct_trig) & (abs_profit > abs_profit_trig) & (base_lqtt[:, :, None] > lqtt_trig) & (against_lqtt[:, None, :] > lqtt_trig)
+
+    n_tickers = len(table.index)
+    n_pairs = len(base_exchanges) * len(against_exchanges)
+
+    if pairs is not None : 
+        ticker_i, base_i, against_i = np.nonzero(profit_pct > 0)
+
+        pairs.append(pd.DataFrame({
+            'base_ticker' : table.index.to_numpy()[ticker_i], 
+            'base' : np.array(base_exchanges, dtype=object)[base_i], 
+            'against' : np.array(against_exchanges, dtype=object)[against_i], 
+            'profit_pct' : profit_pct[ticker_i, base_i, against_i], 
+            'abs_profit' : abs_profit[ticker_i, base_i, against_i], 
+            'size_usd' : size_usd[ticker_i, base_i, against_i], 
+            'base_lqtt_usd' : base_lqtt[ticker_i, base_i], 
+            'against_lqtt' : against_lqtt[ticker_i, against_i]
+        }))
+
+    # every pair goes through the alert state, not only the best one, so a ticker whose best exchange flips between runs 
+    # isn't a new opportunity on every flip, and pairs that stopped triggering are released 
+    if alert_state is None : 
+        alert = trigger
+    else : 
+        alert = alert_state.observe(
+            np.repeat(table.index.to_numpy(), n_pairs), 
+            np.tile(np.repeat(base_exchanges, len(against_exchanges)), n_tickers), 
+            np.tile(against_exchanges, n_tickers * len(base_exchanges)), 
+            profit_pct.reshape(-1), trigger.reshape(-1), profit_pct_trig
+        ).reshape(trigger.shape)
+
+    alerted_profit = np.where(alert, abs_profit, -np.inf).reshape(n_tickers, n_pairs)
+    triggered_profit = np.where(trigger, abs_profit, -np.inf).reshape(n_tickers, n_pairs)
+    any_profit = np.nan_to_num(profit_pct, nan=-np.inf).reshape(n_tickers, n_pairs)
+
+    # the message goes with the best alerted pair, otherwise the best triggered one 
+    best = np.where(trigger.reshape(n_tickers, n_pairs).any(axis=1), triggered_profit.argmax(axis=1), any_profit.argmax(axis=1))
+    best = np.where(alert.reshape(n_tickers, n_pairs).any(axis=1), alerted_profit.argmax(axis=1), best)
+    best_base = best // len(against_exchanges)
+    best_against = best % len(against_exchanges)
+    rows = np.arange(n_tickers)
+
+    df_best = pd.DataFrame({
+        'base_ticker' : table.index, 
+        'best_base' : np.array(base_exchanges, dtype=object)[best_base], 
+        'best_against' : np.array(against_exchanges, dtype=object)[best_against], 
+        'pct_diff' : pct_diff[rows, best_base, best_against], 
+        'profit_pct' : profit_pct[rows, best_base, best_against], 
+        'abs_profit' : abs_profit[rows, best_base, best_against], 
+        'size_usd' : size_usd[rows, best_base, best_against], 
+        'base_lqtt_usd' : base_lqtt[rows, best_base], 
+        'against_lqtt' : against_lqtt[rows, best_against], 
+        'trigger' : trigger[rows, best_base, best_against], 
+        'alert' : alert[rows, best_base, best_against]
+    })
+
+    for row in df_best[df_best['alert']].itertuples() : 
+        base_name = EXCHANGE_NAMES[row.best_base]
+        against_name = EXCHANGE_NAMES[row.best_against]
+
+        tg_notif(alert_message(row, base_name, against_name), destination) 
+
+    return df_best
+
+
+# every run's top of book, 2% band liquidity and exchange rate are written as parquet files under SNAPSHOT_DIR (off when not set), 
+# as the venues and pairs datasets, each partitioned as date=YYYY-MM-DD/hour=HH. A URI like s3://bucket/prefix works too, /tmp on Lambda is gone with the container. 
+# pyarrow is optional and not in requirements.txt, it is only needed when recording. 
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR')
+
+# rows buffered before a file is written, and the longest a buffered row waits, so files stay a reasonable size and memory stays bounded. 
+# The buffer is kept across warm Lambda invocations, rows not written yet are lost if the container is recycled 
+SNAPSHOT_BATCH_ROWS = int(os.environ.get('SNAPSHOT_BATCH_ROWS', 50000))
+SNAPSHOT_FLUSH_INTERVAL = int(os.environ.get('SNAPSHOT_FLUSH_INTERVAL', 3600))
+
+# runs waiting to be written, a run is dropped rather than slowing down execute when the writer falls behind 
+SNAPSHOT_QUEUE_SIZE = 10
+
+
+class SnapshotRecorder : 
+    '''
+    Writes the frames of every run to parquet from a background thread, record only queues references to the frames so the run doesn't wait on it. 
+    Every batch becomes a new zstd compressed part file of each dataset, in the partition of its hour. 
+
+    venues rows : run_time, exchange, base_ticker, price_usd (bid on the base exchanges, mid on the exchanges compared against), ask_price_usd (base exchanges only), 
+    lqtt_usd (2% band liquidity), krw_usd, book and screen_pct. 
+
+    pairs rows : run_time, base_ticker, base, against, profit_pct, abs_profit, size_usd, base_lqtt_usd, against_lqtt for every pair check_venue_table 
+    found a positive profit_pct on, abs_profit and size_usd as walked by walk_books. 
+
+    Tickers of the exchanges compared against that didn't pass screening have no orderbook, they are recorded from the bulk ticker prices 
+    with book False and no lqtt_usd. screen_pct is the profit_pct screening let through from (NaN when the run wasn't screened), 
+    below it the run has no orderbooks to size a premium with. 
+    '''
+
+    def __init__ (self, directory) : 
+        self.directory = directory
+        self.queue = queue.Queue(maxsize=SNAPSHOT_QUEUE_SIZE)
+        self.thread = None
+        self.lock = threading.Lock()
+        self.disabled = False
+
+        # dataset name to the dataframes waiting to be written 
+        self.batch = {}
+        self.batch_rows = 0
+        self.batch_started = None
+
+    def record (self, frames, krw_usd, run_time=None, ticker_prices=None, screen_pct=np.nan, pairs=None) : 
+        '''
+        Accepts the dictionary of exchange name to dataframe of a run, the bulk ticker prices it was screened on (see collect_prices) 
+        and the pairs filled in by check_venue_table. 
+        The frames must not be changed afterwards, check_venue_table and check_price_diff leave them as they are. 
+        '''
+
+        if not self.directory or self.disabled : 
+            return 
+
+        with self.lock : 
+            if self.thread is None or not self.thread.is_alive() : 
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+        try : 
+            self.queue.put_nowait((run_time or datetime.datetime.utcnow(), frames, krw_usd, ticker_prices or {}, screen_pct, pairs or []))
+        except queue.Full : 
+            print('snapshot writer is behind, run not recorded')
+
+    def normalize (self, run_time, frames, krw_usd, ticker_prices, screen_pct, pairs) : 
+        '''
+        Returns the rows of the run as a dictionary of dataset name to dataframe. 
+        '''
+
+        parts = []
+
+        for exchange, df in frames.items() : 
+            base = exchange in BASE_EXCHANGES
+
+            parts.append(pd.DataFrame({
+                'run_time' : run_time, 
+                'exchange' : exchange, 
+                'base_ticker' : df['base_ticker'].to_numpy(), 
+                'price_usd' : df['price_usd'].to_numpy(), 
+                'ask_price_usd' : df['ask_price_usd'].to_numpy() if base else np.nan, 
+                'lqtt_usd' : (df['base_lqtt_usd'] if base else df['against_lqtt']).to_numpy(), 
+                'krw_usd' : float(krw_usd), 
+                'book' : True, 
+                'screen_pct' : float(screen_pct)
+            }))
+
+        # the tickers screened out, from the bulk prices 
+        for exchange, prices in ticker_prices.items() : 
+            booked = set(frames[exchange]['base_ticker']) if exchange in frames else set()
+            assets = [(base_asset(exchange, symbol), price) for symbol, price in prices.items()]
+            assets = [(asset, price) for asset, price in assets if asset and asset not in booked and price > 0]
+
+            parts.append(pd.DataFrame({
+                'run_time' : run_time, 
+                'exchange' : exchange, 
+                'base_ticker' : pd.Series([asset for asset, price in assets], dtype='object'), 
+                'price_usd' : np.array([price for asset, price in assets], dtype=float), 
+                'ask_price_usd' : np.nan, 
+                'lqtt_usd' : np.nan, 
+                'krw_usd' : float(krw_usd), 
+                'book' : False, 
+                'screen_pct' : float(screen_pct)
+            }))
+
+        datasets = {}
+
+        if parts : 
+            datasets['venues'] = pd.concat(parts, ignore_index=True)
+
+        if pairs : 
+            df_pairs = pd.concat(pairs, ignore_index=True)
+            df_pairs.insert(0, 'run_time', run_time)
+            datasets['pairs'] = df_pairs
+
+        return datasets
+
+    def write (self) : 
+        if not self.batch : 
+            return 
+
+        batches = {name : pd.concat(parts, ignore_index=True) for name, parts in self.batch.items()}
+        self.batch = {}
+        self.batch_rows = 0
+        self.batch_started = None
+
+        try : 
+            # only imported once there is something to write 
+            import pyarrow as pa
+            import pyarrow.fs
+            import pyarrow.parquet as pq
+        except ImportError : 
+            print('pyarrow is not installed, snapshot recording turned off')
+            self.disabled = True
+            return 
+
+        if '://' in self.directory : 
+            filesystem, root = pyarrow.fs.FileSystem.from_uri(self.directory)
+        else : 
+            filesystem, root = pyarrow.fs.LocalFileSystem(), os.path.abspath(self.directory)
+
+        with METRICS.stage('record') : 
+            for name, batch in batches.items() : 
+                for hour, rows in batch.groupby(batch['run_time'].dt.floor('h')) : 
+                    partition = '/'.join([root, name, 'date=' + hour.strftime('%Y-%m-%d'), 'hour=' + hour.strftime('%H')])
+                    filesystem.create_dir(partition, recursive=True)
+
+                    path = partition + '/part-{}-{}.parquet'.format(int(time.time() * 1000), os.getpid())
+                    pq.write_table(pa.Table.from_pandas(rows, preserve_index=False), path, compression='zstd', filesystem=filesystem)
+
+    def run (self) : 
+        while True : 
+            try : 
+                item = self.queue.get(timeout=SNAPSHOT_FLUSH_INTERVAL)
+            except queue.Empty : 
+                item = None
+
+            try : 
+                # flush puts (event, write), everything queued before it is buffered by now, and with write also written 
+                if item is not None and isinstance(item[0], threading.Event) : 
+                    done, write = item
+                    if write : 
+                        self.write()
+                    done.set()
+                    continue 
+
+                if item is not None : 
+                    for name, rows in self.normalize(*item).items() : 
+                        self.batch.setdefault(name, []).append(rows)
+                        self.batch_rows += len(rows)
+                        self.batch_started = self.batch_started or time.time()
+
+                if self.batch_rows >= SNAPSHOT_BATCH_ROWS or (self.batch_started and time.time() - self.batch_started >= SNAPSHOT_FLUSH_INTERVAL) : 
+                    self.write()
+
+            except Exception as e : 
+                print('snapshot recording failed :', e)
+
+    def flush (self, timeout=30, write=True) : 
+        '''
+        Blocks until everything recorded so far is written, returns False if that took longer than timeout. 
+
+        Without write the runs are only buffered, and a file is written only if they filled a batch. A Lambda invocation returns after that, 
+        so the container isn't frozen halfway through a write, while its runs still go into files of SNAPSHOT_BATCH_ROWS. 
+        '''
+
+        if self.thread is None or not self.thread.is_alive() : 
+            return True
+
+        done = threading.Event()
+
+        # the queue is full when the writer is behind, the handler mustn't wait on it longer than timeout either 
+        try : 
+            self.queue.put((done, write), timeout=timeout)
+        except queue.Full : 
+            return False
+
+        return done.wait(timeout)
+
+
+RECORDER = SnapshotRecorder(SNAPSHOT_DIR)
+
+atexit.register(RECORDER.flush)
+
+
+@timing_decorator
+def execute(destination) : 
+
+    # configurations 
+    abs_profit_trig = 10000
+    lqtt_trig = 10000
+    profit_pct_trig = 5
+
+    # allows script to return default notification if conditions are not triggered
+    notif_trig = 0 
+
+    # alerts already sent by earlier runs, see AlertState 
+    ALERT_STATE.load()
+
+    # all exchanges are collected at the same time, add 'mexc' to the list to compare against MEXC too 
+    # orderbooks of the exchanges compared against are only requested for tickers that could pass profit_pct_trig 
+    ticker_prices = {}
+
+    with METRICS.stage('collect') : 
+        frames = collect_prices(['upbit', 'bithumb', 'binance', 'bybit', 'bitget'], profit_pct_trig, ticker_prices=ticker_prices)
+
+    # korean exchanges where the prices are more different compared to the rest of the market
+    base_exchanges = ['upbit', 'bithumb']
+
+    # widely used exchanges which are used as comparisons to the Korean ones. 
+    compared_exchanges = ['binance', 'bybit', 'bitget']
+
+    # one table for every exchange, the best base / compared pair is picked per ticker so each token alerts once 
+    with METRICS.stage('merge') : 
+        table = build_venue_table({exchange : frames[exchange] for exchange in base_exchanges}, {exchange : frames[exchange] for exchange in compared_exchanges})
+
+    # includes queueing the alerts, sending them is the alert_flush stage 
+    pairs = []
+
+    with METRICS.stage('check') : 
+        df_best = check_venue_table(table, base_exchanges, compared_exchanges, profit_pct_trig, abs_profit_trig, lqtt_trig, destination, ALERT_STATE, pairs)
+
+    # written in the background, see SnapshotRecorder. The rate is the one collect_prices used, from the cache 
+    RECORDER.record(frames, get_exchange_rate(), ticker_prices=ticker_prices, screen_pct=profit_pct_trig - SCREEN_MARGIN_PCT, pairs=pairs)
+
+    if df_best['trigger'].any() : 
+        notif_trig = 1
     
-    result_list = []
-    for result in results : 
-        result_list.append(result)
-    return result_list
+    # on a slower schedule than the runs 
+    if notif_trig == 0 and ALERT_STATE.heartbeat_due(destination) : 
+        tg_notif("No tickers with absolute profit > $ {:,.0f}".format(abs_profit_trig), destination)
 
+    print('connections per host :', connection_stats())
 
-def call_api (url, **kwargs) : 
+
+# orderbook websocket feeds, Bithumb's v1 feed uses the same request and message format as Upbit. 
+# the environment variables point the daemon at a local stand-in server instead, e.g. to test it offline. 
+WEBSOCKET_FEEDS = {
+    'upbit' : ('UPBIT_WS_URL', 'wss://api.upbit.com/websocket/v1'), 
+    'bithumb' : ('BITHUMB_WS_URL', 'wss://ws-api.bithumb.com/websocket/v1'), 
+    'binance' : ('BINANCE_WS_URL', 'wss://stream.binance.com:9443/stream'), 
+    'bybit' : ('BYBIT_WS_URL', 'wss://stream.bybit.com/v5/public/spot'), 
+    'bitget' : ('BITGET_WS_URL', 'wss://ws.bitget.com/v2/ws/public')
+}
+
+# daemon settings : how often changed books are checked and how often the exchanges compared against are refreshed. Repeated alerts are limited by ALERT_STATE 
+DAEMON_CHECK_INTERVAL = 1
+DAEMON_AGAINST_REFRESH = 30
+
+
+def websocket_feed_url (exchange) : 
+    env_var, default_url = WEBSOCKET_FEEDS[exchange]
+    return os.environ.get(env_var, default_url)
+
+
+async def stream_orderbooks (exchange, url, markets, books, changed) : 
     '''
-    A general use api call function that is able to take in any number of parameters in json format (including no parameters)
+    Subscribes to the orderbook stream of a korean exchange, keeps the latest (bids, asks) levels of every KRW market in books and adds the ticker to changed when it moves. 
+    The levels go through depth_kernel in one batch when the changed tickers are checked. 
 
-    kwargs is in format of a dictionary with key value pairs or the URL parameters. 
+    Every message is a full snapshot of the top of the book, so the latest message is the whole state. Reconnects with a growing delay when the connection drops. 
     '''
 
-    headers = {
-        "accept": "application/json"
-    }
+    request = [
+        {'ticket' : 'upbit_exchange_arb_notif'}, 
+        {'type' : 'orderbook', 'codes' : markets}, 
+        {'format' : 'DEFAULT'}
+    ]
 
-    # if kwargs is not inputted, then kwargs = {}. {} is an acceptable input for params=
-    response = requests.get(url, headers=headers, params=kwargs)
-    
-    # Handle the response and return data as needed.
-    if response.status_code == 200:
-        return response.json()
-    else:
-        tg_notif('API Req Failed : ' + url, 'testing')
-        return {"error": "API request failed"}
-    
-    # convert (usually response is in non JSON form) to json object first 
-    json_object = json.loads(response.text) 
+    delay = 1
 
-    return json_object  
+    # a separate session, the pooled ones have a total timeout which would cut the stream 
+    async with aiohttp.ClientSession() as session : 
+        while True : 
+            try : 
+                async with session.ws_connect(url, heartbeat=30) as ws : 
+                    await ws.send_json(request)
+                    print(exchange, 'orderbook stream connected,', len(markets), 'markets')
+                    delay = 1
 
+                    async for msg in ws : 
+                        if msg.type not in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY) : 
+                            break 
 
-def tg_notif (message, destination) : 
-    
-    url = "https://api.telegram.org/bot{}/sendMessage".format(os.environ.get('TELEGRAM_KEY'))
+                        data = json.loads(msg.data)
 
-    if destination == 'real_time' : 
-        chat_id = '-911570737'
+                        if data.get('type') != 'orderbook' or not data.get('orderbook_units') : 
+                            continue 
 
-    # sending notifications to alternate group for testing purposes
-    else : 
-        chat_id = '-4051618653'
+                        market, bids, asks = parse_orderbook_upbit({'market' : data['code'], 'orderbook_units' : data['orderbook_units']})
+                        ticker = market.replace('KRW-', '')
+                        row = (ticker, bids, asks)
 
-    parameters = {
-        'chat_id' : chat_id,
-        'text' : message
-        }
+                        if books.get(ticker) != row[1:] : 
+                            books[ticker] = row[1:]
+                            changed.add(ticker)
 
-    call_api(url, **parameters)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError) as e : 
+                print(exchange, 'orderbook stream error :', e)
 
+            print(exchange, 'orderbook stream disconnected, reconnecting in', delay, 'seconds')
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
 
-def get_exchange_rate () : 
+
+# symbols per websocket connection for the depth streams of the exchanges compared against 
+DEPTH_STREAM_CHUNK = {
+    'binance' : 200, 
+    'bybit' : 100, 
+    'bitget' : 50
+}
+
+
+class _Level : 
     '''
-    Calling last row from the MongoDB collection. 
+    Node of a BookSide treap, total is the notional (price * size) of the node and everything below it. 
     '''
 
-    collection_name = os.environ.get('COLLECTION_NAME', 'transactions')
-    mongo_conn_str = os.environ.get('MONGO_CONN_STR', 'local')
-    db_name = os.environ.get('DB_NAME', 'upbit_tracker')
-    
-    client = MongoClient(mongo_conn_str)
-    db = client[db_name]
-    collection = db[collection_name]
+    __slots__ = ('price', 'size', 'raw', 'priority', 'left', 'right', 'total')
 
-    for x in collection.find() : 
-        curr_row = x
+    def __init__ (self, price, size, raw) : 
+        self.price = price
+        self.size = size
+        self.raw = raw
+        self.priority = random.random()
+        self.left = None
+        self.right = None
+        self.total = price * size
 
-    return curr_row['exchange_rate']
 
+def _total (node) : 
+    return node.total if node else 0
 
-def call_orderbook_upbit (ticker) : 
+
+def _update (node) : 
+    node.total = node.price * node.size + _total(node.left) + _total(node.right)
+    return node
+
+
+def _split (node, price, inclusive) : 
     '''
-    Accepts ticker, returns current price and liquidity  
+    Splits the treap into (levels below price, the rest). With inclusive the level at price itself goes to the left part. 
     '''
 
-    url = "https://api.upbit.com/v1/orderbook"
+    if node is None : 
+        return None, None
 
-    parameters = {
-        'markets' : ticker
-    }
+    if node.price < price or (inclusive and node.price == price) : 
+        left, right = _split(node.right, price, inclusive)
+        node.right = left
+        return _update(node), right
 
-    json_object = call_api(url, **parameters)
+    left, right = _split(node.left, price, inclusive)
+    node.left = right
+    return left, _update(node)
 
-    orderbook = json_object[0]['orderbook_units']
 
-    # check done here, if too many requests were made at the same time returns error - {'name': 'too_many_requests'}
-    try : 
-        # get bid price, ask price, and liquidty 
-        bid_price = orderbook[0]['bid_price']
-        ask_price = orderbook[0]['ask_price']
-        curr_price = (bid_price + ask_price) / 2
-        lqtt = 0 
+def _merge (left, right) : 
+    if left is None : 
+        return right
+    if right is None : 
+        return left
 
-        # 2% depth liquidity 
-        for order in orderbook : 
-            if order['bid_price'] > curr_price * 0.98 : 
-                lqtt += order['bid_price'] * order['bid_size']
+    if left.priority > right.priority : 
+        left.right = _merge(left.right, right)
+        return _update(left)
 
-        return ticker, bid_price, ask_price, lqtt
-        
-    except : 
-        if json_object['name'] == 'too_many_requests' : 
-            print (ticker + '- too_many_request ERROR!')
-            tg_notif(ticker + '- too_many_request ERROR!')
-        else : 
-            print ('SOME OTHER ERROR')
-            tg_notif('SOME OTHER ERROR')
+    right.left = _merge(left, right.left)
+    return _update(right)
 
 
-def get_prices_upbit() :     
-    ''' 
-    All df_base has output of Dataframe with : 
-    columns = ['base_ticker', 'price_usd', 'ask_price_usd', 'lqtt_usd']
-    datatype of 'price_usd', 'ask_price_usd' and 'lqtt' - float 
+class BookSide : 
     '''
+    One side of an orderbook as a treap ordered by price, every node keeps the running notional of its subtree. 
 
-    columns = ['base_ticker', 'bid_price_krw', 'ask_price_krw', 'base_lqtt']
-    df = pd.DataFrame(columns=columns)
+    Setting a level and the notional between two prices are both O(log n), so band liquidity doesn't rescan the book after an update. 
+    '''
 
-    url = 'https://api.upbit.com/v1/market/all'
-    parameters = {'isDetails': 'false'}
-    
-    json_object = call_api(url, **parameters)
+    def __init__ (self, descending=False) : 
+        self.root = None
+        self.count = 0
+        # bids are best at the highest price, asks at the lowest 
+        self.descending = descending
 
-    ticker_list = []
+    def __len__ (self) : 
+        return self.count
 
-    # list of tokens that are diff between upbit and the rest of the market. 
-    diff_ticker_list = ['TON']
+    def clear (self) : 
+        self.root = None
+        self.count = 0
 
-    for i in json_object : 
-        # take only prices for the ones which compares to KRW 
-        if "KRW" in i['market'] : 
-            ticker_list.append (i['market']) 
+    def set (self, price, size, raw=None) : 
+        '''
+        Inserts or updates the level at price, size 0 removes it. raw keeps the level as sent by the exchange. 
+        '''
 
-    # threads the API call function, max threads is achieved through trial and error. 
-    outputs = thread_func(call_orderbook_upbit, 2, ticker_list)
+        left, rest = _split(self.root, price, False)
+        old, right = _split(rest, price, True)
 
-    for output in outputs : 
-        df.loc[len(df)] = output
+        if old : 
+            self.count -= 1
 
-    df['base_ticker'] = df['base_ticker'].apply(lambda x : x.replace('KRW-', '')) 
+        middle = None
+        if size > 0 : 
+            middle = _Level(price, size, raw)
+            self.count += 1
 
-    curr_ex_rate = get_exchange_rate()
+        self.root = _merge(_merge(left, middle), right)
 
-    df['price_usd'] = df['bid_price_krw'] / curr_ex_rate
-    df['ask_price_usd'] = df['ask_price_krw'] / curr_ex_rate
-    df['base_lqtt_usd'] = df['base_lqtt'] / curr_ex_rate
+    def best (self) : 
+        node = self.root
+        if node is None : 
+            return None
 
-    for ticker in diff_ticker_list : 
-        df = df.drop(df[df['base_ticker'] == ticker].index)
+        if self.descending : 
+            while node.right : 
+                node = node.right
+        else : 
+            while node.left : 
+                node = node.left
 
-    return df 
-    
+        return node.price
 
-def call_orderbook_bithumb (ticker) : 
+    def notional_below (self, price, inclusive=False) : 
+        '''
+        Sum of price * size of every level under price (or at it, with inclusive). 
+        '''
 
-    # orderbook here contains all the tickers, don't have to call prices separately.
-    url = "https://api.bithumb.com/public/orderbook/" + ticker + "_KRW"
+        node = self.root
+        total = 0
 
-    json_object = call_api(url)
+        while node : 
+            if node.price < price or (inclusive and node.price == price) : 
+                total += node.price * node.size + _total(node.left)
+                node = node.right
+            else : 
+                node = node.left
 
-    data = json_object['data'] 
+        return total
 
-    bid_price = float(data['bids'][0]['price']) 
-    ask_price = float(data['asks'][0]['price']) 
+    def notional (self) : 
+        return _total(self.root)
 
-    curr_price = (bid_price + ask_price) / 2
+    def levels (self, depth=None) : 
+        '''
+        Levels from the best price outwards as (price, size, raw), up to depth of them. 
+        '''
 
-    lqtt = 0 
+        output = []
+        stack = []
+        node = self.root
 
-    for bid in data['bids'] : 
-        # 2% depth liquidity 
-        if float(bid['price']) > curr_price * 0.98 :
-            lqtt += float(bid['price']) * float(bid['quantity']) 
+        while (stack or node) and (depth is None or len(output) < depth) : 
+            if node : 
+                stack.append(node)
+                node = node.right if self.descending else node.left
+            else : 
+                node = stack.pop()
+                output.append((node.price, node.size, node.raw))
+                node = node.left if self.descending else node.right
 
-    return ticker, bid_price, ask_price, lqtt
-            
+        return output
 
-def get_prices_bithumb() : 
 
-    # get all tickers and their prices
-    url = "https://api.bithumb.com/public/ticker/ALL_KRW"
+class OrderBook : 
+    '''
+    Bid and ask BookSide of one symbol, shared by anything that keeps a book up to date level by level. 
+    '''
 
-    json_object = call_api(url) 
+    def __init__ (self) : 
+        self.bids = BookSide(descending=True)
+        self.asks = BookSide()
 
-    data = json_object['data']
+    def reset (self, bids, asks) : 
+        self.bids.clear()
+        self.asks.clear()
+        self.apply(bids, asks)
 
-    columns = ['base_ticker', 'bid_price_krw', 'ask_price_krw', 'base_lqtt']
-    df = pd.DataFrame(columns=columns)
+    def apply (self, bids, asks) : 
+        '''
+        bids and asks are lists of [price, size] as strings, size 0 removes the level. 
+        '''
 
-    ticker_list = []
+        for side, levels in ((self.bids, bids), (self.asks, asks)) : 
+            for level in levels : 
+                side.set(float(level[0]), float(level[1]), (level[0], level[1]))
 
-    for ticker, info in data.items() : 
-        if ticker != 'date' : 
-            ticker_list.append(ticker) 
+    def best_bid (self) : 
+        return self.bids.best()
 
-    # threads the API call function, max threads is achieved through trial and error. 
-    outputs = thread_func(call_orderbook_bithumb, 10, ticker_list)
+    def best_ask (self) : 
+        return self.asks.best()
 
-    for output in outputs : 
-        df.loc[len(df)] = output
+    def mid (self) : 
+        if not self.bids or not self.asks : 
+            return None
+        return (self.bids.best() + self.asks.best()) / 2
 
-    curr_ex_rate = get_exchange_rate()
+    def band_liquidity (self, side, pct, curr_price=None) : 
+        '''
+        Notional within pct of the mid, bids above mid * (1 - pct) or asks below mid * (1 + pct). 
+        '''
 
-    df['price_usd'] = df['bid_price_krw'] / curr_ex_rate
-    df['ask_price_usd'] = df['ask_price_krw'] / curr_ex_rate
-    df['base_lqtt_usd'] = df['base_lqtt'] / curr_ex_rate
+        curr_price = curr_price or self.mid()
 
-    return df 
-    
+        if curr_price is None : 
+            return 0
 
-def call_orderbook_binance(ticker) : 
-    # orderbook here contains all the tickers, don't have to call prices separately.
-    url = "https://api.binance.com/api/v3/depth"
+        if side == 'bids' : 
+            return self.bids.notional() - self.bids.notional_below(curr_price * (1 - pct), inclusive=True)
 
-    parameters = {
-        'symbol' : ticker, 
-        'limit' : '5'
-    }
-    
-    json_object = call_api(url, **parameters)
+        return self.asks.notional_below(curr_price * (1 + pct))
 
-    data = json_object
 
-    # sometimes query just fails, or empty orderbook indicate they don't exist as spot anymore
-    if not 'bids' in data or not data['bids']: 
-        return None
+class LocalBook (OrderBook) : 
+    '''
+    Orderbook of one symbol kept up to date from an exchange's depth stream. 
 
-    bid_price = float(data['bids'][0][0])
-    ask_price = float(data['asks'][0][0])
-    curr_price = (bid_price + ask_price) / 2
-    lqtt = 0 
+    synced is only True between a snapshot and the first gap in the updates, books that are not synced are left out of the comparison. 
+    '''
 
-    # 2% depth liquidity 
-    for order in data['asks'] : 
-        if float(order[0]) < curr_price * 1.02 : 
-            lqtt += float(order[0]) * float(order[1])
+    def __init__ (self) : 
+        super().__init__()
+        self.synced = False
+        self.last_update_id = None
 
-    return ticker, curr_price, lqtt
+    def against_row (self) : 
+        '''
+        Returns (curr_price, lqtt) the same way the parse_orderbook_* of the exchanges compared against do, None if a side is empty. 
+        '''
 
+        if not self.synced : 
+            return None
 
-def get_prices_binance() : 
-    ''' 
-    All df_base has output of Dataframe with : 
-    columns = ['base_ticker', 'price_usd']
-    datatype of 'price_usd' - float 
+        curr_price = self.mid()
+
+        if curr_price is None : 
+            return None
+
+        # 2% depth liquidity 
+        return curr_price, self.band_liquidity('asks', 0.02, curr_price)
+
+
+# ask levels of a local book kept for walk_books, the same depth as the binance orderbook requests 
+WALK_LEVELS = 100
+
+
+class DepthCache : 
+    '''
+    Local orderbooks of the exchanges compared against, fed by their depth streams, so the comparison can read price_usd and against_lqtt without a network call. 
     '''
 
-    url = "https://api.binance.com/api/v3/ticker/price"
+    def __init__ (self) : 
+        self.books = {}
+        # base tickers whose book moved since the last pop_changed 
+        self.changed = set()
 
-    json_object = call_api(url)
+    def book (self, exchange, symbol) : 
+        return self.books.setdefault(exchange, {}).setdefault(symbol, LocalBook())
 
-    columns = ['base_ticker', 'price_usd', 'against_lqtt']
-    df = pd.DataFrame(columns=columns)
+    def mark_changed (self, exchange, symbol) : 
+        self.changed.add(base_asset(exchange, symbol))
 
-    # some of the tokens have been delisted but is still in the API showing wrong prices, 
-    delisted_tickers = ['BTG']
+    def pop_changed (self) : 
+        changed = self.changed
+        self.changed = set()
+        return changed
 
-    # previous empty orderbooks 
-    # 'BCC', 'VEN', 'PAX', 'BCHABC', 'BCHSV', 'BTT', 'USDS', 'NANO', 'MITH', 'USDSB', 'GTO', 'ERD', 'NPXS', 'COCOS', 'MFT', 'STORM', 'BEAM', 'HC', 'MCO', 'BULL', 'BEAR', 'ETHBULL']
+    def unsync (self, exchange, symbols) : 
+        for symbol in symbols : 
+            self.book(exchange, symbol).synced = False
 
-    ticker_list = []
+    def frame (self, exchange) : 
+        '''
+        Same dataframe as build_df_against, from the synced books only. The asks are cut at WALK_LEVELS levels. 
+        '''
 
-    # returns only the base pair for USDT pairs 
-    for ticker in json_object : 
-        if 'USDT' in  ticker['symbol'] : 
-            base_ticker = ticker['symbol'].replace('USDT', '')
-            if base_ticker not in delisted_tickers : 
-                ticker_list.append(ticker['symbol'])
+        tickers = []
+        price_usd = []
+        against_lqtt = []
+        asks = []
 
-    # threads the API call function, max threads is achieved through trial and error. 
-    outputs = thread_func(call_orderbook_binance, 20, ticker_list)
+        for symbol, book in self.books.get(exchange, {}).items() : 
+            row = book.against_row()
+            if row : 
+                tickers.append(base_asset(exchange, symbol))
+                price_usd.append(row[0])
+                against_lqtt.append(row[1])
+                asks.append(np.array([(price, size) for price, size, raw in book.asks.levels(WALK_LEVELS)], dtype=float).reshape(-1, 2))
 
-    for output in outputs : 
-        df.loc[len(df)] = output
+        return against_frame(tickers, price_usd, against_lqtt, asks)
 
-    # remove rows which does not have entries 
-    df.dropna(inplace=True)
 
-    df['base_ticker'] = df['base_ticker'].apply(lambda x : x.replace('USDT', ''))
+async def depth_stream_binance (cache, symbols) : 
+    '''
+    Binance diff depth stream. Updates are buffered until a REST snapshot arrives, then applied from the snapshot's lastUpdateId onwards. 
+    A gap between the last applied update (u) and the first update id of the next event (U) drops the book and takes a new snapshot. 
+    '''
 
-    return df 
+    url = websocket_feed_url('binance') + '?streams=' + '/'.join(symbol.lower() + '@depth@100ms' for symbol in symbols)
+    buffers = {}
 
+    async def snapshot (symbol, delay=1) : 
+        book = cache.book('binance', symbol)
+        buffers[symbol] = []
 
-def call_orderbook_bybit(ticker) :     
-    # this url in their documentation gives false info, like DOGEUSDT. The one below is more complete, but does not encompass every single token that is traded too. 
-    # url = "https://api-testnet.bybit.com/v5/market/orderbook"
+        try : 
+            json_object = await call_api_async("https://api.binance.com/api/v3/depth", 5, symbol=symbol, limit='100')
 
-    url = "https://api.bybit.com/v2/public/orderBook/L2"
+            if 'lastUpdateId' not in json_object : 
+                raise ValueError(json_object)
 
-    parameters = {
-        'symbol' : ticker
-    }
+            book.reset(json_object['bids'], json_object['asks'])
+            book.last_update_id = json_object['lastUpdateId']
+            book.synced = True
 
-    json_object = call_api(url, **parameters)
+            events = buffers.pop(symbol, [])
+            for event in events : 
+                apply_event(symbol, event)
 
-    data = json_object['result']
+        # a snapshot that never lands would leave the symbol buffering forever, its updates are dropped until the retry instead 
+        except Exception as e : 
+            buffers.pop(symbol, None)
+            book.synced = False
 
-    if not data : 
-        return None
+            print('binance', symbol, 'snapshot failed, retrying in', delay, 'seconds -', e)
+            await asyncio.sleep(delay)
+            asyncio.ensure_future(snapshot(symbol, min(delay * 2, 60)))
 
-    for order in data : 
-        if order['side'] == 'Buy' : 
-            bid_price = float(order['price'])
-            break 
+    def apply_event (symbol, event) : 
+        book = cache.book('binance', symbol)
 
-    for order in data : 
-        if order['side'] == 'Sell' : 
-            ask_price = float(order['price'])
-            break 
-    
-    curr_price = (bid_price + ask_price) / 2
-    lqtt = 0 
+        # still waiting for the snapshot 
+        if symbol in buffers : 
+            buffers[symbol].append(event)
+            return
 
-    # 2% depth liquidity 
-    for order in data : 
-        if order['side'] == 'Buy' : 
-            if float(order['price']) < curr_price * 1.02 : 
-                lqtt += float(order['price']) * float(order['size'])
+        if not book.synced or event['u'] <= book.last_update_id : 
+            return
 
-    return ticker, curr_price, lqtt
+        if event['U'] > book.last_update_id + 1 : 
+            print('binance', symbol, 'gap in depth updates, resyncing')
+            book.synced = False
+            asyncio.ensure_future(snapshot(symbol))
+            buffers[symbol] = [event]
+            return
 
+        book.apply(event['b'], event['a'])
+        book.last_update_id = event['u']
+        cache.mark_changed('binance', symbol)
 
-def get_prices_bybit () : 
-    url = "https://api.bybit.com/v5/market/tickers?category=spot"
-    
-    json_object = call_api(url) 
+    await run_depth_stream('binance', url, symbols, cache, None, lambda ws : [asyncio.ensure_future(snapshot(symbol)) for symbol in symbols], lambda ws, data : apply_event(data['data']['s'], data['data']) if 'data' in data else None)
 
-    data = json_object['result']['list']
 
-    columns = ['base_ticker', 'price_usd', 'against_lqtt']
-    df = pd.DataFrame(columns=columns)
+async def depth_stream_bybit (cache, symbols) : 
+    '''
+    Bybit v5 orderbook stream, a snapshot message resets the book and deltas have to follow on the update id (u). 
+    A gap resubscribes the symbol, which makes Bybit send a fresh snapshot. 
+    '''
 
-    ticker_list = []
+    url = websocket_feed_url('bybit')
+    topics = ['orderbook.50.' + symbol for symbol in symbols]
 
-    # returns only the base pair for USDT pairs 
-    for ticker in data : 
-        if 'USDT' in  ticker['symbol'] : 
-            ticker_list.append(ticker['symbol']) 
+    async def subscribe (ws) : 
+        # bybit takes at most 10 topics per subscribe request 
+        for i in range(0, len(topics), 10) : 
+            await ws.send_json({'op' : 'subscribe', 'args' : topics[i:i + 10]})
 
-    # threads the API call function, max threads is achieved through trial and error. 
-    outputs = thread_func(call_orderbook_bybit, 20, ticker_list)
+    async def resubscribe (ws, topic) : 
+        await ws.send_json({'op' : 'unsubscribe', 'args' : [topic]})
+        await ws.send_json({'op' : 'subscribe', 'args' : [topic]})
 
-    for output in outputs : 
-        df.loc[len(df)] = output
+    def on_message (ws, data) : 
+        if 'topic' not in data or 'data' not in data : 
+            return
 
-    df.dropna(inplace=True)
+        symbol = data['data']['s']
+        book = cache.book('bybit', symbol)
 
-    df['base_ticker'] = df['base_ticker'].apply(lambda x : x.replace('USDT', ''))
+        if data['type'] == 'snapshot' : 
+            book.reset(data['data']['b'], data['data']['a'])
+            book.synced = True
 
-    return df 
+        elif not book.synced : 
+            return
 
+        elif data['data']['u'] != book.last_update_id + 1 : 
+            print('bybit', symbol, 'gap in depth updates, resyncing')
+            book.synced = False
+            asyncio.ensure_future(resubscribe(ws, data['topic']))
+            return
 
-def call_orderbook_bitget (ticker) : 
-    # orderbook here contains all the tickers, don't have to call prices separately.
-    url = "https://api.bitget.com/api/v2/spot/market/orderbook"
+        else : 
+            book.apply(data['data']['b'], data['data']['a'])
 
-    parameters = {
-        'symbol' : ticker, 
-        'limit' : '150'
-    }
+        book.last_update_id = data['data']['u']
+        cache.mark_changed('bybit', symbol)
 
-    json_object = call_api(url, **parameters)
+    await run_depth_stream('bybit', url, symbols, cache, {'op' : 'ping'}, subscribe, on_message)
 
-    data = json_object['data']
-    
-    # dealing with empty data
-    if not data['asks']: 
-        return None
 
-    ask_price = float(data['asks'][0][0])
-    bid_price = float(data['bids'][0][0])
-    curr_price = (bid_price + ask_price) / 2
-    lqtt = 0 
+def bitget_checksum (book) : 
+    '''
+    CRC32 of the first 25 bid and ask levels interleaved as bid price:bid size:ask price:ask size..., using the strings as sent by Bitget. 
+    '''
 
-    # 2% depth liquidity 
-    for order in data['asks'] : 
-        if float(order[0]) < curr_price * 1.02 : 
-            lqtt += float(order[0]) * float(order[1])
+    bids = [level[2] for level in book.bids.levels(25)]
+    asks = [level[2] for level in book.asks.levels(25)]
 
-    return ticker, curr_price, lqtt
+    fields = []
+    for i in range(max(len(bids), len(asks))) : 
+        if i < len(bids) : 
+            fields.extend(bids[i])
+        if i < len(asks) : 
+            fields.extend(asks[i])
 
+    checksum = zlib.crc32(':'.join(fields).encode())
 
-def get_prices_bitget () : 
-    url = 'https://api.bitget.com/api/spot/v1/market/tickers'
+    # bitget sends it as a signed 32 bit integer 
+    return checksum - (1 << 32) if checksum >= (1 << 31) else checksum
 
-    json_object = call_api(url) 
 
-    data = json_object['data']
+async def depth_stream_bitget (cache, symbols) : 
+    '''
+    Bitget v2 books stream, a snapshot action resets the book and every update carries a checksum of the top 25 levels. 
+    A checksum mismatch resubscribes the symbol, which makes Bitget send a fresh snapshot. 
+    '''
 
-    columns = ['base_ticker', 'price_usd', 'against_lqtt']
-    df = pd.DataFrame(columns=columns)
+    url = websocket_feed_url('bitget')
 
-    ticker_list = []
+    def arg (symbol) : 
+        return {'instType' : 'SPOT', 'channel' : 'books', 'instId' : symbol}
 
-    for ticker in data : 
-        # some tickers does not have a price 
-        if ticker['buyOne'] != '0':
-            if 'USDT' in  ticker['symbol'] : 
-                ticker_list.append(ticker['symbol'])
+    async def subscribe (ws) : 
+        await ws.send_json({'op' : 'subscribe', 'args' : [arg(symbol) for symbol in symbols]})
 
-    # threads the API call function, max threads is achieved through trial and error. 
-    outputs = thread_func(call_orderbook_bitget, 2, ticker_list)
+    async def resubscribe (ws, symbol) : 
+        await ws.send_json({'op' : 'unsubscribe', 'args' : [arg(symbol)]})
+        await ws.send_json({'op' : 'subscribe', 'args' : [arg(symbol)]})
 
-    for output in outputs : 
-        df.loc[len(df)] = output
+    def on_message (ws, data) : 
+        if 'action' not in data or not data.get('data') : 
+            return
 
-    df.dropna(inplace=True)
+        symbol = data['arg']['instId']
+        book = cache.book('bitget', symbol)
+        update = data['data'][0]
 
-    df['base_ticker'] = df['base_ticker'].apply(lambda x : x.replace('USDT', ''))
+        if data['action'] == 'snapshot' : 
+            book.reset(update['bids'], update['asks'])
+            book.synced = True
 
-    return df 
+        elif not book.synced : 
+            return
 
+        else : 
+            book.apply(update['bids'], update['asks'])
 
-def call_orderbook_mexc (ticker) : 
-    # orderbook here contains all the tickers, don't have to call prices separately.
-    url = 'https://api.mexc.com/api/v3/depth'
+        if 'checksum' in update and bitget_checksum(book) != update['checksum'] : 
+            print('bitget', symbol, 'checksum mismatch, resyncing')
+            book.synced = False
+            asyncio.ensure_future(resubscribe(ws, symbol))
+            return
 
-    parameters = {
-        'symbol' : ticker, 
-    }
+        cache.mark_changed('bitget', symbol)
 
-    json_object = call_api(url, **parameters)
+    await run_depth_stream('bitget', url, symbols, cache, 'ping', subscribe, on_message)
 
-    data = json_object
 
-    print(ticker)
-    print(data) 
+async def run_depth_stream (exchange, url, symbols, cache, ping, on_connect, on_message) : 
+    '''
+    Connection loop shared by the depth streams. Every book of the connection is dropped when it disconnects, and synced again after reconnecting. 
 
-    if not data['bids'] : 
-        return None
-    
-    ask_price = float(data['asks'][0][0])
-    bid_price = float(data['bids'][0][0])
-    curr_price = (bid_price + ask_price) / 2
-    lqtt = 0 
+    ping is the application level ping the exchange expects every 20 seconds (None if it only needs websocket pings). 
+    '''
 
-    # 2% depth liquidity 
-    for order in data['asks'] : 
-        if float(order[0]) < curr_price * 1.02 : 
-            lqtt += float(order[0]) * float(order[1])
+    delay = 1
 
-    return ticker, curr_price, lqtt
+    async def keep_alive (ws) : 
+        while True : 
+            await asyncio.sleep(20)
+            if isinstance(ping, dict) : 
+                await ws.send_json(ping)
+            else : 
+                await ws.send_str(ping)
 
+    async with aiohttp.ClientSession() as session : 
+        while True : 
+            pinger = None
 
-def get_prices_mexc () : 
-    url = 'https://api.mexc.com/api/v3/ticker/price'
+            try : 
+                async with session.ws_connect(url, heartbeat=30) as ws : 
+                    print(exchange, 'depth stream connected,', len(symbols), 'symbols')
+                    delay = 1
 
-    json_object = call_api(url)
+                    result = on_connect(ws)
+                    if asyncio.iscoroutine(result) : 
+                        await result
 
-    columns = ['base_ticker', 'price_usd', 'against_lqtt']
-    df = pd.DataFrame(columns=columns)
+                    if ping : 
+                        pinger = asyncio.ensure_future(keep_alive(ws))
 
-    # some of the tokens give the wrong prices on MEXC
-    dysfunc_tickers = ['GMT', 'GAS', 'META', 'TITAN', 'ALT']
+                    async for msg in ws : 
+                        if msg.type not in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY) : 
+                            break 
 
-    ticker_list = []
+                        # bitget answers the ping with a plain pong 
+                        if msg.data == 'pong' : 
+                            continue 
 
-    print(json_object)
+                        on_message(ws, json.loads(msg.data))
 
-    # returns only the base pair for USDT pairs 
-    for ticker in json_object : 
-        if 'USDT' in ticker['symbol'] : 
-            base_ticker = ticker['symbol'].replace('USDT', '')
-            if base_ticker not in dysfunc_tickers : 
-                ticker_list.append(ticker['symbol'])
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError) as e : 
+                print(exchange, 'depth stream error :', e)
 
-    # threads the API call function, max threads is achieved through trial and error. 
-    outputs = thread_func(call_orderbook_mexc, 10, ticker_list)
+            if pinger : 
+                pinger.cancel()
 
-    for output in outputs : 
-        df.loc[len(df)] = output
+            cache.unsync(exchange, symbols)
 
-    df.dropna(inplace=True)
+            print(exchange, 'depth stream disconnected, reconnecting in', delay, 'seconds')
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
 
-    df['base_ticker'] = df['base_ticker'].apply(lambda x : x.replace('USDT', ''))
 
-    return df 
+DEPTH_STREAMS = {
+    'binance' : depth_stream_binance, 
+    'bybit' : depth_stream_bybit, 
+    'bitget' : depth_stream_bitget
+}
 
 
-def check_price_diff (df_base, df_against, base_name, against_name, notif_trig, profit_pct_trig, abs_profit_trig, lqtt_trig, destination) : 
+def depth_stream_tasks (cache, ticker_lists) : 
     '''
-    Accepts list of tickers for two exchanges, maps the tickers, and sends notification when triggered. 
+    Accepts exchange to symbol list, returns the coroutines streaming all of them into the cache, split into DEPTH_STREAM_CHUNK symbols per connection. 
     '''
 
-    df_base.rename(columns={'price_usd' : 'price_usd_base', 'ask_price_usd' : 'ask_price_usd_base'}, inplace=True)
+    tasks = []
 
-    df_against.rename(columns={'price_usd' : 'price_usd_against'}, inplace=True)
+    for exchange, symbols in ticker_lists.items() : 
+        symbols = list(symbols)
+        chunk = DEPTH_STREAM_CHUNK[exchange]
+        for i in range(0, len(symbols), chunk) : 
+            tasks.append(DEPTH_STREAMS[exchange](cache, symbols[i:i + chunk]))
 
-    df_combined = pd.merge(df_base, df_against, on='base_ticker', how='left')
+    return tasks
 
-    # if positive then base is higher, if negative then base is lower. 
-    df_combined['usd_diff'] = df_combined['price_usd_base'] - df_combined['price_usd_against']
-    df_combined['pct_diff'] = abs(df_combined['usd_diff'] / df_combined['price_usd_against']) 
 
-    # Formula explanation : We are buying token from other exchanges, selling on upbit for KRW, sell KRW for ETH, and send back. So we need ask price of ETH on upbit instead bid price. 
+def daemon_base_frame (exchange, books, tickers, curr_ex_rate) : 
+    '''
+    Dataframe of a korean exchange from the books kept by stream_orderbooks (asset to (bids, asks)), for the assets in tickers that have a book. 
 
-    df_combined['ask_usd_diff'] = df_combined['ask_price_usd_base'] - df_combined['price_usd_against']
-    df_combined['ask_pct_diff'] = abs(df_combined['ask_usd_diff'] / df_combined['price_usd_against']) 
+    The books are keyed by the asset, the build_df functions take the venue symbols of the orderbook requests. 
+    '''
 
-    # get ask price pct difference of ETH 
-    for index, row in df_combined.iterrows() : 
-        if df_combined.loc[index, 'base_ticker'] == 'ETH' : 
-            base_eth_ask_price_pct = df_combined.loc[index, 'ask_pct_diff']
-            break 
+    rows = [(venue_symbol(exchange, ticker),) + books[ticker] for ticker in tickers if ticker in books]
 
-    for index, row in df_combined.iterrows() : 
-        # case when base price > against price
-        if df_combined.loc[index, 'usd_diff'] > 0 : 
+    # build_df_upbit takes the outputs in batches 
+    if exchange == 'upbit' : 
+        return build_df_upbit([rows], curr_ex_rate)
 
-            profit_pct =  100 * (df_combined.loc[index, 'pct_diff']  + 1) * (1 - base_eth_ask_price_pct) - 100
+    return build_df_bithumb(rows, curr_ex_rate)
 
-            abs_profit = profit_pct / 100 * df_combined.loc[index, 'base_lqtt_usd']
 
-            # for troubleshooting purposes 
-            # print(df_combined.loc[index, 'base_ticker'], df_combined.loc[index, 'pct_diff'], base_eth_ask_price_pct, profit_pct)
-            
-            # conditions for notification trigger
-            if profit_pct > profit_pct_trig and abs_profit > abs_profit_trig and df_combined.loc[index, 'base_lqtt_usd'] > lqtt_trig and df_combined.loc[index, 'against_lqtt'] > lqtt_trig : 
-                notif_trig = 1
-                message1 = '{} - {} is higher than {} by {:.2f} %.'.format(df_combined.loc[index, 'base_ticker'], base_name, against_name, abs(df_combined.loc[index, 'pct_diff']) * 100)
-                message2 = 'Absolute Profit - $ {:,.0f}'.format(abs_profit)
+async def run_daemon_async (destination, against_exchanges, profit_pct_trig, abs_profit_trig, lqtt_trig, use_depth_cache=True) : 
+    '''
+    Keeps every KRW orderbook of Upbit and Bithumb in memory from their websocket feeds and runs the premium check whenever a book changes, 
+    so premiums lasting less than the one minute cron are still caught. 
 
-                message3 = 'Profit Pct Estimate - {:.2f} %'.format(profit_pct)
-                message4 = '{} 2% Depth Liquidity - $ {:,.0f}'.format(base_name, df_combined.loc[index, 'lqtt_usd'])
-        
-                tg_notif(str(message1 + '\n\n' + message2 + '\n\n' + message3 + '\n' + message4), destination) 
-    
-    return notif_trig
-    
+    With use_depth_cache the exchanges compared against are read from a DepthCache fed by their depth streams, for the symbols listed on Upbit or Bithumb. 
+    A change on either side triggers the check. Otherwise they are refreshed over REST every DAEMON_AGAINST_REFRESH seconds. 
+    '''
 
-@timing_decorator
-def execute(destination) : 
+    loop = asyncio.get_running_loop()
 
-    # configurations 
-    abs_profit_trig = 10000
-    lqtt_trig = 10000
-    profit_pct_trig = 5
+    upbit_markets = await loop.run_in_executor(None, get_universe, 'upbit')
+    bithumb_markets = ['KRW-' + ticker for ticker in await loop.run_in_executor(None, get_universe, 'bithumb')]
 
-    # allows script to return default notification if conditions are not triggered
-    notif_trig = 0 
+    books = {'upbit' : {}, 'bithumb' : {}}
+    changed = {'upbit' : set(), 'bithumb' : set()}
+    state = {'against_frames' : {}, 'ex_rate' : None, 'ex_rate_time' : 0}
 
-    df_upbit = get_prices_upbit() 
-    df_bithumb = get_prices_bithumb()
+    await loop.run_in_executor(None, ALERT_STATE.load)
 
-    # # exchanges compared to 
-    df_binance = get_prices_binance() 
-    df_bybit = get_prices_bybit() 
-    df_bitget = get_prices_bitget()
-    # df_mexc = get_prices_mexc()
+    depth_cache = DepthCache()
+    depth_tasks = []
 
-    # korean exchanges where the prices are more different compared to the rest of the market
-    base_exchanges = [
-        {
-            'exchange_name' : 'Upbit',
-            'exchange_df' : df_upbit
-        },
-        {
-            'exchange_name' : 'Bithumb',
-            'exchange_df' : df_bithumb
-        }
-    ]
+    if use_depth_cache : 
+        # depth is only streamed for the assets also listed on upbit or bithumb 
+        registry = await loop.run_in_executor(None, get_registry, BASE_EXCHANGES + against_exchanges)
+        assets = tradable_assets(registry, BASE_EXCHANGES + against_exchanges)
 
-    # widely used exchanges which are used as comparisons to the Korean ones. 
-    compared_exchanges = [
-        {
-            'exchange_name' : 'Binance',
-            'exchange_df' : df_binance
-        },
-        {
-            'exchange_name' : 'Bybit',
-            'exchange_df' : df_bybit
-        },
-        {
-            'exchange_name' : 'Bitget',
-            'exchange_df' : df_bitget
-        }
-        # {
-        #     'exchange_name' : 'MEXC',
-        #     'exchange_df' : df_mexc
-        # }
-    ]
-    
-    for base in base_exchanges : 
-        for compared in compared_exchanges : 
-            notif_trig = check_price_diff(base['exchange_df'], compared['exchange_df'], base['exchange_name'], compared['exchange_name'], notif_trig, profit_pct_trig, abs_profit_trig, lqtt_trig, destination)
-    
-    if notif_trig == 0 : 
-        tg_notif("No tickers with absolute profit > $ {:,.0f}".format(abs_profit_trig), destination)
+        depth_tasks = depth_stream_tasks(depth_cache, {
+            exchange : sorted(registry[asset][exchange] for asset in assets if exchange in registry[asset]) 
+            for exchange in against_exchanges
+        })
+
+    def current_base_frame (exchange, tickers) : 
+        return daemon_base_frame(exchange, books[exchange], tickers, state['ex_rate'])
+
+    async def books_ready () : 
+        '''
+        Waits until every subscribed market sent its first orderbook, so the first screen isn't run on empty books. 
+        Gives up after DAEMON_AGAINST_REFRESH seconds, markets that never send are picked up by the next refresh. 
+        '''
+
+        deadline = time.time() + DAEMON_AGAINST_REFRESH
+
+        while time.time() < deadline and (len(books['upbit']) < len(upbit_markets) or len(books['bithumb']) < len(bithumb_markets)) : 
+            await asyncio.sleep(DAEMON_CHECK_INTERVAL)
+
+    async def refresh_against () : 
+        # only ETH would pass a screen of empty books, leaving nothing to compare against until the next refresh 
+        if not use_depth_cache : 
+            await books_ready()
+
+        while True : 
+            try : 
+                # exchange rate is only updated hourly 
+                if time.time() - state['ex_rate_time'] > 3600 : 
+                    state['ex_rate'] = await loop.run_in_executor(None, get_exchange_rate)
+                    state['ex_rate_time'] = time.time()
+
+                # the depth streams keep the exchanges compared against up to date 
+                if use_depth_cache : 
+                    await asyncio.sleep(DAEMON_AGAINST_REFRESH)
+                    continue 
+
+                base_frames = [current_base_frame(exchange, list(books[exchange])) for exchange in books if books[exchange]]
+                ticker_lists = await asyncio.gather(*[loop.run_in_executor(None, COLLECTORS[exchange][0]) for exchange in against_exchanges])
+
+                against_frames = {}
+                for exchange, ticker_list in zip(against_exchanges, ticker_lists) : 
+                    against_frames[exchange] = await collect_exchange_async(exchange, screen_tickers(exchange, ticker_list, base_frames, profit_pct_trig))
+
+                state['against_frames'] = against_frames
+
+            except Exception as e : 
+                print('refreshing exchanges compared against failed :', e)
+
+            await asyncio.sleep(DAEMON_AGAINST_REFRESH)
+
+    async def check_changed () : 
+        while True : 
+            await asyncio.sleep(DAEMON_CHECK_INTERVAL)
+
+            if use_depth_cache and state['ex_rate'] : 
+                state['against_frames'] = {exchange : depth_cache.frame(exchange) for exchange in against_exchanges}
+
+                # a move on the exchanges compared against is checked like a move on the base exchange 
+                moved = depth_cache.pop_changed()
+                for exchange in books : 
+                    changed[exchange].update(moved & set(books[exchange]))
+
+            if not state['against_frames'] : 
+                continue 
+
+            for exchange in books : 
+                # ETH is needed for the exit discount 
+                if 'ETH' not in books[exchange] or not changed[exchange] : 
+                    continue 
+
+                # stream_orderbooks keeps adding to the same set, it is emptied in place 
+                tickers = set(changed[exchange])
+                changed[exchange].clear()
+
+                df_base = current_base_frame(exchange, tickers | {'ETH'})
+
+                for against_exchange, df_against in state['against_frames'].items() : 
+                    # the telegram messages are only queued, the dataframe work is kept off the event loop 
+                    with METRICS.stage('check', exchange=against_exchange) : 
+                        await loop.run_in_executor(None, check_price_diff, df_base, df_against, EXCHANGE_NAMES[exchange], EXCHANGE_NAMES[against_exchange], profit_pct_trig, abs_profit_trig, lqtt_trig, destination, ALERT_STATE)
+
+    await asyncio.gather(
+        stream_orderbooks('upbit', websocket_feed_url('upbit'), upbit_markets, books['upbit'], changed['upbit']), 
+        stream_orderbooks('bithumb', websocket_feed_url('bithumb'), bithumb_markets, books['bithumb'], changed['bithumb']), 
+        refresh_against(), 
+        check_changed(), 
+        *depth_tasks
+    )
+
+
+def run_daemon (destination) : 
+    '''
+    Long running alternative to execute, runs until stopped. 
+    '''
+
+    # configurations, same as execute 
+    abs_profit_trig = 10000
+    lqtt_trig = 10000
+    profit_pct_trig = 5
+
+    if METRICS_PORT : 
+        start_metrics_server(METRICS_PORT)
+
+    get_event_loop().run_until_complete(run_daemon_async(destination, ['binance', 'bybit', 'bitget'], profit_pct_trig, abs_profit_trig, lqtt_trig))
 
 
 
@@ -630,7 +3639,8 @@ def lambda_handler(event, context):
     # tg notification destination for testing purposes 
     destination = 'real_time'
 
-    execute(destination)
+    # warm invocations reuse the connections, Mongo client, exchange rate and symbol universe of the previous ones 
+    run_warm(destination)
 
     return {
         'statusCode': 200,